@@ -0,0 +1,160 @@
+import email.parser
+import email.policy
+import http.server
+import json
+import os
+import re
+import threading
+import urllib.parse
+import yaml
+
+# Local stand-ins of the Polygon and DOMjudge APIs used by p2d, so that the
+# whole pipeline can be run (and timed) without credentials and without
+# network. They do not check the authentication of the requests.
+
+# Size of the chunks in which the packages are sent and received.
+CHUNK_SIZE = 2**20
+
+# Base class of the servers: a threaded HTTP server running in a daemon
+# thread. The handler is the class Handler of the subclass, which can access
+# the server (and its state) as self.server.
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), self.Handler)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def address(self):
+        return 'http://%s:%s' % self.server_address
+
+    def count_call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('content-length', 0)))
+
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Polygon APIs (at address + '/api/'): problem.packages, problem.package and
+# contest.problems.
+# packages is a dictionary {problem_id: (revision, path of the zip)}.
+class FakePolygon(_Server):
+    def __init__(self, packages):
+        self.packages = packages
+        super().__init__()
+
+    @property
+    def address(self):
+        return super().address + '/api/'
+
+    class Handler(_Handler):
+        def do_POST(self):
+            method = self.path.rsplit('/', 1)[-1]
+            params = urllib.parse.parse_qs(self.read_body().decode())
+            params = {key: values[0] for key, values in params.items()}
+            self.server.count_call(method)
+
+            if method == 'problem.packages':
+                revision, _ = self.server.packages[params['problemId']]
+                self.send_json({'status': 'OK', 'result': [{
+                    'id': revision, 'revision': revision,
+                    'state': 'READY', 'type': 'linux'}]})
+            elif method == 'problem.package':
+                _, zip_path = self.server.packages[params['problemId']]
+                self.send_package(zip_path)
+            elif method == 'contest.problems':
+                self.send_json({'status': 'OK', 'result': {
+                    str(i): {'id': problem_id, 'name': problem_id}
+                    for i, problem_id in enumerate(self.server.packages)}})
+            else:
+                self.send_json({'status': 'FAILED',
+                                'comment': 'Unknown method %s.' % method}, 400)
+
+        # Sends the zip, honouring a range request (as Polygon does).
+        def send_package(self, zip_path):
+            size = os.path.getsize(zip_path)
+            start = 0
+            match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('range', ''))
+            if match and int(match.group(1)) < size:
+                start = int(match.group(1))
+                self.send_response(206)
+                self.send_header('content-range',
+                                 'bytes %d-%d/%d' % (start, size - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('content-type', 'application/zip')
+            self.send_header('content-length', str(size - start))
+            self.end_headers()
+            with open(zip_path, 'rb') as f:
+                f.seek(start)
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    self.wfile.write(chunk)
+
+# DOMjudge APIs: api/v4/contests/<cid>/problems/add-data (which assigns
+# consecutive ids to the problems) and api/v4/contests/<cid>/problems (which
+# receives and discards the package).
+class FakeDomjudge(_Server):
+    def __init__(self):
+        self.next_id = 1
+        self.uploaded_bytes = 0
+        super().__init__()
+
+    class Handler(_Handler):
+        def do_POST(self):
+            if self.path.endswith('/problems/add-data'):
+                self.server.count_call('add-data')
+                self.add_data()
+            elif self.path.endswith('/problems'):
+                self.server.count_call('problems')
+                self.upload()
+            else:
+                self.read_body()
+                self.send_json({'message': 'Unknown API.'}, 404)
+
+        def add_data(self):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                b'content-type: ' + self.headers['content-type'].encode()
+                + b'\r\n\r\n' + self.read_body())
+            problems = yaml.safe_load(
+                next(message.iter_parts()).get_payload(decode=True))
+            with self.server.lock:
+                ids = [str(self.server.next_id + i) for i in range(len(problems))]
+                self.server.next_id += len(problems)
+            self.send_json(ids)
+
+        def upload(self):
+            size = int(self.headers.get('content-length', 0))
+            remaining = size
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+            with self.server.lock:
+                self.server.uploaded_bytes += size
+            self.send_json({'problem_id': '1', 'messages': []})
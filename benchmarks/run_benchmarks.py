@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import yaml
+
+import fake_servers
+import synthetic_package
+
+# Runs the whole pipeline of p2d (download, conversion, upload) on synthetic
+# contests, against local stand-ins of Polygon and DOMjudge, and prints the
+# wall time of each stage (as measured by p2d --report).
+# See benchmarks/README.md.
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PDFLATEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'fake_pdflatex')
+
+# Stand-in of testlib.h, passed to p2d (with --testlib) so that it does not
+# download testlib.h from GitHub. The synthetic problems use a standard
+# checker, hence testlib.h is not included in the DOMjudge packages. The
+# first line marks it as already patched for DOMjudge (see testlib_store).
+TESTLIB_STAND_IN = '''\
+// Modified by a script to work with DOMjudge.
+// Stand-in of testlib.h for the benchmarks.
+'''
+
+# The stages shown in the table; the time of a stage is the sum over all the
+# problems (hence, with --jobs, it may be larger than the total time).
+STAGES = ['download', 'convert', 'convert.zip', 'tex2pdf', 'register',
+          'upload']
+
+def prepare_argument_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks of p2d on synthetic contests. The arguments not listed here are passed to p2d (e.g., --jobs 4 or --compression stored).')
+    parser.add_argument('--problems', type=int, nargs='+', default=[1, 10], metavar='N', help='Numbers of problems of the contests. Default: %(default)s.')
+    parser.add_argument('--tests', type=int, nargs='+', default=[50], metavar='N', help='Numbers of tests of each problem. Default: %(default)s.')
+    parser.add_argument('--test-size', type=int, nargs='+', default=[10**4, 10**6], metavar='BYTES', help='Sizes (in bytes) of each test. Default: %(default)s.')
+    parser.add_argument('--samples', type=int, default=2, metavar='N', help='Number of samples of each problem. Default: %(default)s.')
+    parser.add_argument('--pdflatex', choices=['fake', 'real'], default='fake', help='Whether the statements are compiled with the real pdflatex or with a stand-in which returns immediately. Default: %(default)s.')
+    parser.add_argument('--runs', type=int, default=1, metavar='N', help='Number of runs of each benchmark (the median time is reported). Default: %(default)s.')
+    parser.add_argument('--output', metavar='PATH', help='Write the results (including the full reports of p2d) into PATH, as json.')
+    parser.add_argument('--keep-dir', metavar='DIR', help='Create the contests in DIR (which is not deleted at the end), instead of in a temporary directory.')
+    return parser
+
+# Creates in work_dir the Polygon packages and the contest directory
+# work_dir/contest of a benchmark. Returns the dictionary {problem_id:
+# (revision, zip path)} of the packages.
+def make_contest(work_dir, problems, tests, test_size, samples):
+    packages_dir = os.path.join(work_dir, 'packages')
+    os.makedirs(packages_dir, exist_ok=True)
+    packages = {}
+    for i in range(problems):
+        name = 'problem%d' % i
+        zip_path = os.path.join(packages_dir, name + '.zip')
+        synthetic_package.make_polygon_package(
+            zip_path, name, tests=tests, test_size=test_size,
+            samples=samples, seed=i)
+        packages[name] = (1, zip_path)
+    return packages
+
+# Writes the config.yaml of the contest in contest_dir (which is emptied).
+def write_config(contest_dir, packages, polygon_address, domjudge_address):
+    shutil.rmtree(contest_dir, ignore_errors=True)
+    os.makedirs(contest_dir)
+    config = {
+        'contest_name': 'Benchmark',
+        'polygon': {'key': 'key', 'secret': 'secret',
+                    'address': polygon_address},
+        'domjudge': {'server': domjudge_address, 'username': 'admin',
+                     'password': 'password', 'contest_id': 'benchmark'},
+        'problems': [{
+            'name': name,
+            'label': chr(ord('A') + i % 26) + ('' if i < 26 else str(i // 26)),
+            'color': 'Red',
+            'author': 'Author',
+            'preparation': 'Preparation',
+            'polygon_id': name
+        } for i, name in enumerate(packages)]
+    }
+    with open(os.path.join(contest_dir, 'config.yaml'), 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False, sort_keys=False)
+
+# Runs p2d on contest_dir and returns its report.
+def run_p2d(contest_dir, pdflatex, p2d_args):
+    report_path = os.path.join(contest_dir, 'report.json')
+    command = [sys.executable, '-m', 'p2d.p2d', contest_dir,
+               '--polygon', '--convert', '--domjudge',
+               '--package-cache-dir', os.path.join(contest_dir, 'cache'),
+               '--package-cache-size', '0',
+               '--report', report_path,
+               '--verbosity', 'warning'] + p2d_args
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPOSITORY_PATH] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    if pdflatex == 'fake':
+        env['PATH'] = FAKE_PDFLATEX_PATH + os.pathsep + env.get('PATH', '')
+    logging.debug('Running: %s' % ' '.join(command))
+    result = subprocess.run(command, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL)
+    if result.returncode != 0:
+        logging.error('p2d exited with code %s.' % result.returncode)
+        exit(1)
+    with open(report_path) as f:
+        return json.load(f)
+
+# Returns {stage: time} from the report of p2d, where the time of a stage is
+# summed over all the problems.
+def stage_times(report):
+    times = {}
+    for record in report['records']:
+        times[record['stage']] = times.get(record['stage'], 0) + record['wall_time']
+    return times
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def print_row(cells):
+    print(''.join(str(cell).rjust(12) for cell in cells), flush=True)
+
+def main():
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    args, p2d_args = prepare_argument_parser().parse_known_args()
+
+    if args.pdflatex == 'real' and shutil.which('pdflatex') is None:
+        logging.error('pdflatex is not installed.')
+        exit(1)
+
+    base_dir = args.keep_dir or tempfile.mkdtemp(prefix='p2d-benchmarks-')
+    os.makedirs(base_dir, exist_ok=True)
+    # The benchmarks must not depend on the network.
+    if '--testlib' not in p2d_args:
+        testlib_h = os.path.join(base_dir, 'testlib.h')
+        with open(testlib_h, 'w') as f:
+            f.write(TESTLIB_STAND_IN)
+        p2d_args += ['--testlib', testlib_h]
+
+    results = []
+    print_row(['problems', 'tests', 'test size', 'total'] + STAGES)
+    try:
+        for problems, tests, test_size in itertools.product(
+                args.problems, args.tests, args.test_size):
+            work_dir = os.path.join(base_dir, '%s-%s-%s' % (problems, tests, test_size))
+            packages = make_contest(work_dir, problems, tests, test_size,
+                                    min(args.samples, tests))
+            contest_dir = os.path.join(work_dir, 'contest')
+
+            reports = []
+            for _ in range(args.runs):
+                with fake_servers.FakePolygon(packages) as polygon, \
+                     fake_servers.FakeDomjudge() as domjudge:
+                    write_config(contest_dir, packages, polygon.address,
+                                 domjudge.address)
+                    reports.append(run_p2d(contest_dir, args.pdflatex, p2d_args))
+
+            times = [stage_times(report) for report in reports]
+            row = {stage: median([t.get(stage, 0) for t in times])
+                   for stage in ['total'] + STAGES}
+            print_row([problems, tests, test_size]
+                      + ['%.3f' % row[stage] for stage in ['total'] + STAGES])
+            results.append({'problems': problems, 'tests': tests,
+                            'test_size': test_size, 'times': row,
+                            'reports': reports})
+    finally:
+        if not args.keep_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'arguments': sys.argv, 'results': results}, f, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import json
+import random
+import zipfile
+
+# Generator of synthetic Polygon packages, with the same structure of the
+# packages (of type linux) built by Polygon, but with random tests.
+
+PROBLEM_XML = '''\
+<?xml version="1.0" encoding="utf-8" standalone="no"?>
+<problem revision="{revision}" short-name="{name}" url="https://polygon.codeforces.com/p/benchmark/{name}">
+    <names>
+        <name language="english" value="Benchmark problem {name}"/>
+    </names>
+    <statements>
+        <statement charset="UTF-8" language="english" mathjax="true" path="statements/english/problem.tex" type="application/x-tex"/>
+    </statements>
+    <judging cpu-name="Intel(R) Core(TM) i3-8100 CPU @ 3.60GHz" cpu-speed="3600" input-file="" output-file="">
+        <testset name="tests">
+            <time-limit>1000</time-limit>
+            <memory-limit>268435456</memory-limit>
+            <test-count>{test_count}</test-count>
+            <input-path-pattern>tests/%02d</input-path-pattern>
+            <answer-path-pattern>tests/%02d.a</answer-path-pattern>
+            <tests>
+{tests}
+            </tests>
+        </testset>
+    </judging>
+    <files>
+        <resources>
+            <file path="files/olymp.sty"/>
+            <file path="files/testlib.h" type="h.g++"/>
+        </resources>
+        <executables>
+            <executable>
+                <source path="files/gen.cpp" type="cpp.g++17"/>
+            </executable>
+            <executable>
+                <source path="files/validator.cpp" type="cpp.g++17"/>
+            </executable>
+        </executables>
+    </files>
+    <assets>
+        <checker name="std::ncmp.cpp" type="testlib">
+            <source path="files/check.cpp" type="cpp.g++17"/>
+            <binary path="check.exe" type="exe.win32"/>
+        </checker>
+        <validators>
+            <validator>
+                <source path="files/validator.cpp" type="cpp.g++17"/>
+            </validator>
+        </validators>
+        <solutions>
+            <solution tag="main">
+                <source path="solutions/main.cpp" type="cpp.g++17"/>
+            </solution>
+            <solution tag="accepted">
+                <source path="solutions/accepted.py" type="python.3"/>
+            </solution>
+            <solution tag="wrong-answer">
+                <source path="solutions/wrong.cpp" type="cpp.g++17"/>
+            </solution>
+            <solution tag="time-limit-exceeded">
+                <source path="solutions/slow.cpp" type="cpp.g++17"/>
+            </solution>
+        </solutions>
+    </assets>
+</problem>
+'''
+
+SOLUTION = '''\
+#include <bits/stdc++.h>
+int main() {
+    long long x, s = 0;
+    while (std::cin >> x) s += x;
+    std::cout << s << std::endl;
+}
+'''
+
+# A 1x1 transparent png.
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c63000100000500010d0a2db4000000'
+    '0049454e44ae426082')
+
+# Returns a block of size bytes of random integers (separated by spaces and
+# newlines), which is about as compressible as a typical test.
+def random_numbers(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = str(rng.randrange(10**9)) + (' ' if rng.randrange(10) else '\n')
+        words.append(word)
+        length += len(word)
+    return ''.join(words).encode()[:size]
+
+# Returns a test of size bytes, made of random slices of pool.
+def random_test(rng, pool, size):
+    pieces = []
+    while size > 0:
+        length = min(size, rng.randrange(1, len(pool) // 2))
+        start = rng.randrange(len(pool) - length + 1)
+        pieces.append(pool[start:start + length])
+        size -= length
+    return b''.join(pieces)
+
+# Writes into zip_path a synthetic Polygon package of the problem name, with
+# `tests` tests of test_size bytes each; the first `samples` tests are
+# samples. The contents are deterministic (given seed).
+# The package contains also the files which are not necessary for the
+# conversion (generator, validator, statements in another language, ...).
+def make_polygon_package(zip_path, name, tests=10, test_size=1000, samples=2,
+                         revision=1, seed=0):
+    assert(1 <= samples <= tests)
+    rng = random.Random(seed)
+    # The tests are made of slices of a pool of random numbers, which is much
+    # faster than generating each test from scratch. The pool is much larger
+    # than the window of deflate, so the tests are not more compressible than
+    # usual.
+    pool = random_numbers(rng, 4 * 2**20)
+
+    tests_xml = '\n'.join(
+        '                <test method="manual"%s/>'
+        % (' sample="true"' if i < samples else '') for i in range(tests))
+
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.writestr('problem.xml', PROBLEM_XML.format(
+            revision=revision, name=name, test_count=tests, tests=tests_xml))
+
+        sample_tests = []
+        for i in range(1, tests + 1):
+            test_input = random_test(rng, pool, test_size)
+            test_answer = b'%d\n' % rng.randrange(10**18)
+            z.writestr('tests/%02d' % i, test_input)
+            z.writestr('tests/%02d.a' % i, test_answer)
+            if i <= samples:
+                z.writestr('statements/english/example.%02d' % i, test_input)
+                z.writestr('statements/english/example.%02d.a' % i, test_answer)
+                sample_tests.append({'inputFile': 'example.%02d' % i,
+                                     'outputFile': 'example.%02d.a' % i})
+
+        z.writestr('statements/english/problem-properties.json', json.dumps({
+            'name': 'Benchmark problem ' + name,
+            'legend': 'Compute the sum of the numbers (see Figure \\ref{fig}).\n\n'
+                      '\\includegraphics{picture.png}\\label{fig}',
+            'input': 'A list of integers.',
+            'output': 'Their sum.',
+            'interaction': None,
+            'notes': '%BEGIN 1\nJust sum the numbers.\n%END\n',
+            'tutorial': 'Read the numbers and sum them.',
+            'sampleTests': sample_tests
+        }, indent=2))
+        z.writestr('statements/english/picture.png', PNG)
+        z.writestr('statements/english/problem.tex', '% Not used by p2d.\n')
+        z.writestr('statements/russian/problem-properties.json', '{}')
+
+        z.writestr('files/check.cpp', '#include "testlib.h"\n// std::ncmp.cpp\n')
+        z.writestr('files/gen.cpp', '#include "testlib.h"\nint main() {}\n')
+        z.writestr('files/validator.cpp', '#include "testlib.h"\nint main() {}\n')
+        z.writestr('files/testlib.h', '// testlib.h\n')
+        z.writestr('files/olymp.sty', '% olymp.sty\n')
+        z.writestr('solutions/main.cpp', SOLUTION)
+        z.writestr('solutions/accepted.py', 'import sys\nprint(sum(map(int, sys.stdin.read().split())))\n')
+        z.writestr('solutions/wrong.cpp', SOLUTION.replace('s += x', 's -= x'))
+        z.writestr('solutions/slow.cpp', SOLUTION.replace('s += x', 's += x; while (true);'))
+        # Same bytes as rng.randbytes(4096), which requires Python 3.9.
+        z.writestr('check.exe', rng.getrandbits(4096 * 8).to_bytes(4096, 'little'))
@@ -0,0 +1,141 @@
+import os
+import threading
+import yaml
+import logging
+
+from p2d._version import __version__
+from p2d import file_utils, p2d_utils
+
+# Name of the file (in the contest directory) storing the state of the
+# problems, if the key 'separate_state' is set in config.yaml.
+STATE_YAML = 'state.yaml'
+
+# Keys of the description of a problem which are managed by p2d (and not by
+# the user).
+STATE_KEYS = ['polygon_version', 'domjudge_local_version',
+              'domjudge_server_version', 'domjudge_local_fingerprint',
+              'domjudge_server_fingerprint', 'domjudge_id',
+              'domjudge_externalid']
+
+# Delay (in seconds) between a call to ConfigStore.save and the actual write
+# on disk. All the calls to save during this interval result in a single
+# write.
+SAVE_DELAY = 1.0
+
+def _dump(data):
+    return yaml.safe_dump(data, default_flow_style=False, sort_keys=False)
+
+# Persistent storage of config.yaml (i.e., of the configuration of the contest
+# and of the state of its problems).
+#
+# The dictionary config must be modified only while holding lock; then save()
+# must be called. The writes on disk are delayed by SAVE_DELAY seconds, so
+# that many consecutive calls to save() (e.g., one for each stage of each
+# problem) produce a single write. Call flush() to write immediately (e.g.,
+# after a non-repeatable operation, or before exiting).
+# A file is rewritten only if its content changed, and it is always replaced
+# atomically.
+#
+# If the key 'separate_state' is true in config.yaml, the keys of the problems
+# managed by p2d (see STATE_KEYS) are stored in contest_dir/state.yaml, so that
+# config.yaml (which is edited by the user) is rewritten only when p2d changes
+# the configuration itself (e.g., with --from-contest).
+class ConfigStore:
+    def __init__(self, contest_dir, delay=SAVE_DELAY):
+        self.contest_dir = contest_dir
+        self.delay = delay
+        self.config_yaml = os.path.join(contest_dir, 'config.yaml')
+        self.state_yaml = os.path.join(contest_dir, STATE_YAML)
+        self.lock = threading.RLock()
+        self.timer = None
+        self.dirty = False
+
+        self.config = p2d_utils.load_config_yaml(contest_dir)
+        self.separate_state = bool(self.config.get('separate_state', False))
+        # Whether config.yaml contains some state (e.g., if 'separate_state'
+        # was just set); in that case the state is moved to state.yaml at the
+        # first write.
+        state_in_config = any(key in problem
+                              for problem in self.config.get('problems') or []
+                              for key in STATE_KEYS)
+        if self.separate_state and os.path.isfile(self.state_yaml):
+            with open(self.state_yaml, 'r') as f:
+                try:
+                    state = yaml.safe_load(f) or {}
+                except yaml.YAMLError as exc:
+                    logging.error('The file \'%s\' is not a valid yaml file: %s'
+                                  % (self.state_yaml, exc))
+                    exit(1)
+            for problem in self.config.get('problems') or []:
+                problem.update(state.get(problem.get('name'), {}))
+
+        # The content of the files on disk, as last read or written.
+        self.written = self._serialize()
+        if self.separate_state and state_in_config:
+            self.written[self.config_yaml] = None
+        if self.separate_state and not os.path.isfile(self.state_yaml):
+            self.written[self.state_yaml] = None
+
+    # Returns the content of the files to be written, as {path: text}.
+    def _serialize(self):
+        if not self.separate_state:
+            return {self.config_yaml: _dump(self.config)}
+
+        config = dict(self.config)
+        config['problems'] = []
+        state = {}
+        for problem in self.config.get('problems') or []:
+            config['problems'].append(
+                {key: value for key, value in problem.items()
+                 if key not in STATE_KEYS})
+            problem_state = {key: problem[key] for key in STATE_KEYS
+                             if key in problem}
+            if problem_state:
+                state[problem['name']] = problem_state
+        return {self.config_yaml: _dump(config), self.state_yaml: _dump(state)}
+
+    # Reloads config.yaml from disk, so that the changes made by the user
+    # while p2d is running (e.g., with --watch) are not reverted by the next
+    # write. The state of the problems (see STATE_KEYS) is kept from memory,
+    # as it may not have been written yet. The dictionary config is updated
+    # in place, but the dictionaries of the problems are replaced.
+    # If 'separate_state' is set, config.yaml is not rewritten until p2d
+    # changes the configuration itself (so that the comments and the
+    # formatting of the user are kept).
+    def reload(self):
+        with self.lock:
+            state = {problem.get('name'): {key: problem[key] for key in STATE_KEYS
+                                           if key in problem}
+                     for problem in self.config.get('problems') or []}
+            config = p2d_utils.load_config_yaml(self.contest_dir)
+            for problem in config.get('problems') or []:
+                problem.update(state.get(problem.get('name'), {}))
+            self.config.clear()
+            self.config.update(config)
+            if self.separate_state:
+                self.written[self.config_yaml] = \
+                    self._serialize()[self.config_yaml]
+
+    # Schedules a write of the configuration on disk.
+    def save(self):
+        with self.lock:
+            self.dirty = True
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    # Writes the configuration on disk, if it changed since the last write.
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            self.dirty = False
+            for path, text in self._serialize().items():
+                if self.written.get(path) != text:
+                    logging.debug('Writing \'%s\'.' % path)
+                    file_utils.write_atomic(path, text)
+                    self.written[path] = text
@@ -4,76 +4,246 @@ import random
 import requests
 import string
 import sys
-import tempfile
+import threading
+import time
+import uuid
 import yaml
 import logging
 
 from p2d._version import __version__
+from p2d import instrumentation, p2d_utils
+
+# Default (connect, read) timeouts, in seconds, of the requests to DOMjudge.
+# The read timeout is long since DOMjudge processes the whole package before
+# answering an upload.
+DEFAULT_TIMEOUT = (10, 600)
+
+# Default number of retries of an upload to DOMjudge which failed because of
+# a connection error or of a 5xx status code.
+DEFAULT_RETRIES = 3
+
+# Default maximum number of packages uploaded at the same time.
+DEFAULT_MAX_UPLOADS = 4
 
 def generate_externalid(problem):
     random_suffix = ''.join(random.choice(string.ascii_uppercase) for _ in range(6))
     return problem['label'] + '-' + problem['name'] + '-' + random_suffix
 
 
-# credentials is a dictionary with keys contest_id, server, username, password.
-def call_domjudge_api(api_address, data, files, credentials):
-    res = requests.post(
-        credentials['server'] + api_address,
-        auth=requests.auth.HTTPBasicAuth(
-            credentials['username'], credentials['password']),
-        data=data,
-        files=files)
-    return res
-
-# Updates the problem on the server with the package_zip.
-# Returns true if the update was successful.
-def update_problem_api(package_zip, problem_domjudge_id, credentials):
-    api_address = '/api/v4/contests/%s/problems' % credentials['contest_id']
-    
-    with open(package_zip, 'rb') as f:
-        res = call_domjudge_api(api_address,
-                                {'problem': problem_domjudge_id},
-                                {'zip': (package_zip, f)},
-                                credentials)
-
-    if res.status_code == 413:
-        logging.error('Received error \'413 Request Entity Too Large\' while sending the package to the DOMjudge server. The server configuration must be changed to accept larger files.')
-        return False
-    elif res.status_code != 200 or not res.json()['problem_id']:
-        logging.error('Error sending the package to the DOMjudge server: %s.'
-                      % res.json())
-        return False
-    else:
+# File-like object producing (lazily) the multipart/form-data body of a
+# request.
+#   fields is a dictionary {name: value} of the plain form fields;
+#   files is a dictionary {name: (file_name, source)}, where source is either
+#   the path of a file or its content (as bytes).
+# The files are read from disk in chunks only while the body is sent, so the
+# memory usage does not depend on their size. Since the length of the body is
+# known in advance, the request is sent with a Content-Length header.
+# A progress bar (labelled desc) shows how much of the body was sent.
+class MultipartEncoder:
+    CHUNK_SIZE = 2**20
+
+    def __init__(self, fields, files, desc=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + self.boundary
+        self.desc = desc
+
+        # Each part is either bytes or the path of a file.
+        self.parts = []
+        for name, value in fields.items():
+            self.parts.append(self._part_header(name) + str(value).encode('utf-8') + b'\r\n')
+        for name, (file_name, source) in files.items():
+            self.parts.append(self._part_header(name, file_name))
+            self.parts.append(source)
+            self.parts.append(b'\r\n')
+        self.parts.append(('--%s--\r\n' % self.boundary).encode('utf-8'))
+
+        self.length = sum(len(part) if isinstance(part, bytes)
+                          else os.path.getsize(part) for part in self.parts)
+        self.chunks = None
+        self.chunk = b''    # Chunk being read, from the byte self.position.
+        self.position = 0
+
+    def _part_header(self, name, file_name=None):
+        header = '--%s\r\nContent-Disposition: form-data; name="%s"' \
+            % (self.boundary, name)
+        if file_name is not None:
+            header += '; filename="%s"\r\nContent-Type: application/octet-stream' \
+                % file_name
+        return (header + '\r\n\r\n').encode('utf-8')
+
+    def _iter_chunks(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                    yield chunk
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if self.chunks is None:
+            self.chunks = iter(p2d_utils.wrap_iterable_in_tqdm(
+                self._iter_chunks(), self.length // self.CHUNK_SIZE,
+                unit_scale=self.CHUNK_SIZE/1024, desc=self.desc))
+        data = []
+        while size != 0:
+            if self.position == len(self.chunk):
+                self.chunk = next(self.chunks, b'')
+                self.position = 0
+                if not self.chunk:
+                    break
+            available = len(self.chunk) - self.position
+            taken = available if size < 0 else min(size, available)
+            data.append(self.chunk[self.position:self.position + taken])
+            self.position += taken
+            if size > 0:
+                size -= taken
+        data = b''.join(data)
+        instrumentation.add_network_bytes(sent=len(data))
+        return data
+
+# Returns a description of the content of the response (its json, if the
+# content is a valid json).
+def _describe_response(res):
+    try:
+        return res.json()
+    except ValueError:
+        return res.text
+
+# Client for the DOMjudge APIs, relative to a single contest.
+# It owns a requests.Session authenticated with the credentials of the admin
+# user, so that the connections to the server (at most pool_size of them) are
+# reused across all the API calls.
+# At most max_uploads problem packages are uploaded at the same time (the
+# uploads are issued by the problems processed concurrently).
+# The uploads of packages, which are idempotent, are retried up to `retries`
+# times with exponential backoff if they fail because of a connection error
+# or a 5xx status code.
+class DomjudgeClient:
+    def __init__(self, server, username, password, contest_id,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 max_uploads=DEFAULT_MAX_UPLOADS, pool_size=10):
+        self.server = server
+        self.contest_id = contest_id
+        self.timeout = timeout
+        self.retries = retries
+        self.upload_semaphore = threading.BoundedSemaphore(max_uploads)
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.auth = requests.auth.HTTPBasicAuth(username, password)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Constructs the client from the subdictionary 'domjudge' of config.yaml.
+    # The keys 'server', 'username', 'password', 'contest_id' are mandatory,
+    # while 'timeout' (in seconds) and 'retries' are optional.
+    @staticmethod
+    def from_config(domjudge_config, max_uploads=DEFAULT_MAX_UPLOADS,
+                    pool_size=10):
+        timeout = domjudge_config.get('timeout')
+        return DomjudgeClient(
+            domjudge_config['server'], domjudge_config['username'],
+            domjudge_config['password'], domjudge_config['contest_id'],
+            timeout=DEFAULT_TIMEOUT if timeout is None else (timeout, timeout),
+            retries=domjudge_config.get('retries', DEFAULT_RETRIES),
+            max_uploads=max_uploads, pool_size=pool_size)
+
+    # Sends a POST request to the API api_address (relative to the server).
+    # files is a dictionary {name: (file_name, source)} as in
+    # MultipartEncoder; the body of the request is streamed.
+    def call(self, api_address, data, files, desc=None):
+        body = MultipartEncoder(data, files, desc=desc)
+        res = self.session.post(
+            self.server + api_address,
+            data=body,
+            headers={'Content-Type': body.content_type},
+            timeout=self.timeout)
+        instrumentation.add_network_bytes(received=len(res.content))
+        return res
+
+    # Updates the problem on the server with the package_zip.
+    # The package is sent with the file name zip_name (by default, the name
+    # of package_zip).
+    # Returns true if the update was successful. A failure is logged, but it
+    # never raises, so that the other problems can be uploaded anyway.
+    def update_problem(self, package_zip, problem_domjudge_id, zip_name=None):
+        api_address = '/api/v4/contests/%s/problems' % self.contest_id
+        if zip_name is None:
+            zip_name = os.path.basename(package_zip)
+
+        with self.upload_semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    res = self.call(api_address,
+                                    {'problem': problem_domjudge_id},
+                                    {'zip': (zip_name, package_zip)},
+                                    desc='Uploading DOMjudge package')
+                    error = None if res.status_code < 500 \
+                        else 'status %s' % res.status_code
+                except requests.exceptions.RequestException as e:
+                    error = str(e)
+                if error is None:
+                    break
+                if attempt == self.retries:
+                    logging.error('Error sending the package to the DOMjudge '
+                                  'server: %s.' % error)
+                    return False
+                delay = 2 ** attempt
+                logging.debug('Upload of the package to the DOMjudge server '
+                              'failed (%s), retrying in %s seconds.'
+                              % (error, delay))
+                time.sleep(delay)
+
+        if res.status_code == 413:
+            logging.error('Received error \'413 Request Entity Too Large\' while sending the package to the DOMjudge server. The server configuration must be changed to accept larger files.')
+            return False
+
+        description = _describe_response(res)
+        if res.status_code != 200 or not isinstance(description, dict) \
+                or not description.get('problem_id'):
+            logging.error('Error sending the package to the DOMjudge server: %s.'
+                          % description)
+            return False
+
         logging.debug('Successfully sent the package to the DOMjudge server.')
         return True
 
-# Adds an "empty" problem to a contest.
-# Returns true if the problem was successfully added. In such case, it sets
-# the 'domjudge_id' and 'domjudge_externalid' of the problem.
-# credentials is a dictionary with keys contest_id, server, username, password.
-def add_problem_to_contest_api(problem, credentials):
-    api_address = '/api/v4/contests/%s/problems/add-data' % credentials['contest_id']
-    externalid = generate_externalid(problem)
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.yaml', mode='w',
-                                     encoding='utf-8') as f:
-        problem_yaml = f.name
-        yaml.safe_dump([{
+    # Adds "empty" problems to the contest, with a single request.
+    # Returns true if the problems were successfully added. In such case, it
+    # sets the 'domjudge_id' and 'domjudge_externalid' of each problem.
+    # This request is not idempotent, hence it is never retried.
+    def add_problems_to_contest(self, problems):
+        api_address = '/api/v4/contests/%s/problems/add-data' % self.contest_id
+        externalids = [generate_externalid(problem) for problem in problems]
+
+        problems_yaml = yaml.safe_dump([{
                 'id': externalid,
                 'label': problem['label'],
                 'name': problem['name']
-            }],
-            f, default_flow_style=False, sort_keys=False)
+            } for problem, externalid in zip(problems, externalids)],
+            default_flow_style=False, sort_keys=False).encode('utf-8')
 
-    with open(problem_yaml, 'rb') as f:
-        res = call_domjudge_api(api_address, {}, {'data': (problem_yaml, f)}, credentials)
-    os.unlink(problem_yaml)
+        try:
+            res = self.call(api_address, {}, {'data': ('problems.yaml', problems_yaml)})
+        except requests.exceptions.RequestException as e:
+            logging.error('Error adding the problems to the contest: %s.' % e)
+            return False
 
-    if res.status_code != 200:
-        logging.error('Error adding the problem to the contest: %s.' % res.json())
-        return False
+        description = _describe_response(res)
+        if res.status_code != 200 or not isinstance(description, list) \
+                or len(description) != len(problems):
+            logging.error('Error adding the problems to the contest: %s.'
+                          % description)
+            return False
 
-    problem['domjudge_id'] = res.json()[0]
-    problem['domjudge_externalid'] = externalid
+        # The ids are returned in the same order of the problems.
+        for problem, externalid, domjudge_id in zip(problems, externalids, description):
+            problem['domjudge_id'] = domjudge_id
+            problem['domjudge_externalid'] = externalid
 
-    return True
+        return True
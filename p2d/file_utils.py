@@ -0,0 +1,181 @@
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import logging
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows.
+    fcntl = None
+
+from p2d._version import __version__
+
+# Ways in which materialize_file can create a file equal to another one:
+#   reflink = copy-on-write clone of the file (supported by btrfs, xfs, ...);
+#   hardlink = hard link to the file;
+#   copy = byte-by-byte copy of the file;
+#   auto = the first among reflink, hardlink and copy which succeeds.
+LINK_MODES = ['auto', 'reflink', 'hardlink', 'copy']
+
+# Link mode used by materialize_file. It is set from the command line.
+LINK_MODE = 'auto'
+
+# A file inside a zip archive.
+#   zip_file is the (open) zipfile.ZipFile;
+#   info is the zipfile.ZipInfo of the file.
+# The functions of this module accepting a source (i.e., file_sha256,
+# same_content, source_size, source_basename, materialize_file) accept either
+# the path of a file or a ZipMember.
+class ZipMember:
+    def __init__(self, zip_file, info):
+        self.zip_file = zip_file
+        self.info = info
+
+    def open(self):
+        return self.zip_file.open(self.info)
+
+    def __repr__(self):
+        return '<%s in \'%s\'>' % (self.info.filename, self.zip_file.filename)
+
+def _open_source(source):
+    if isinstance(source, ZipMember):
+        return source.open()
+    return open(source, 'rb')
+
+# Returns the size (in bytes) of the source.
+def source_size(source):
+    if isinstance(source, ZipMember):
+        return source.info.file_size
+    return os.path.getsize(source)
+
+# Returns the name of the file (without the directories) of the source.
+def source_basename(source):
+    if isinstance(source, ZipMember):
+        return source.info.filename.rsplit('/', 1)[-1]
+    return os.path.basename(source)
+
+# Returns the sha256 (as hexadecimal string) of the content of the source.
+def file_sha256(source):
+    sha256 = hashlib.sha256()
+    with _open_source(source) as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+# Returns whether the two sources have the same content. The sizes are
+# compared first, the sources are read (and hashed) only if the sizes
+# coincide.
+def same_content(source1, source2):
+    if source_size(source1) != source_size(source2):
+        return False
+    return file_sha256(source1) == file_sha256(source2)
+
+# The ioctl request code of FICLONE (see `man ioctl_ficlone`).
+FICLONE = 0x40049409
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported.')
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return
+        except OSError:
+            pass
+    os.unlink(dst)
+    raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported.')
+
+# Creates the file dst with the same content of src (if dst exists, it is
+# replaced), according to LINK_MODE (or to mode, if given).
+# The non-copy modes turn the copy of a file into a metadata operation, but
+# they may be unavailable (e.g., src and dst are on different filesystems);
+# in that case the file is copied. If src is a ZipMember, it is always
+# extracted (i.e., copied).
+#
+# ACHTUNG: With mode hardlink, dst and src are the same file, so dst must
+#          never be modified in place.
+def materialize_file(src, dst, mode=None):
+    mode = mode or LINK_MODE
+    assert(mode in LINK_MODES)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if isinstance(src, ZipMember):
+        with src.open() as src_file, open(dst, 'wb') as dst_file:
+            shutil.copyfileobj(src_file, dst_file, 2**20)
+        return
+
+    if mode in ['auto', 'reflink']:
+        try:
+            _reflink(src, dst)
+            return
+        except OSError:
+            if mode == 'reflink':
+                logging.debug('Could not reflink \'%s\', copying it instead.'
+                              % src)
+
+    if mode in ['auto', 'hardlink']:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            if mode == 'hardlink':
+                logging.debug('Could not hard link \'%s\', copying it instead.'
+                              % src)
+
+    shutil.copyfile(src, dst)
+
+# Returns the directory of the caches of the user (following the XDG base
+# directory specification), where p2d keeps the data shared by all the
+# contests.
+def cache_home():
+    return os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+
+# The umask of the process (read once, as it can be read only by changing it).
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# Sets the permissions of tmp_path, a temporary file which is going to replace
+# path: the ones of path if it exists, otherwise the ones of a file created
+# with open(). The temporary files created by tempfile are readable only by
+# the owner.
+def set_replacement_mode(tmp_path, path):
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+    os.chmod(tmp_path, mode)
+
+# Writes text into the file path atomically: the content is written into a
+# temporary file (in the same directory), flushed to disk and renamed to path.
+# If the process crashes, path contains either the old or the new content.
+def write_atomic(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', dir=directory,
+            prefix=os.path.basename(path) + '.', suffix='.tmp',
+            delete=False) as f:
+        try:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    set_replacement_mode(f.name, path)
+    os.replace(f.name, path)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:     # Directories cannot be opened on Windows.
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
@@ -1,8 +1,6 @@
 import json
 import os
-import pathlib
 import re
-import shutil
 import subprocess
 import sys
 import tempfile
@@ -12,10 +10,7 @@ import zipfile
 import logging
 
 from p2d._version import __version__
-from p2d import tex_utilities
-
-RESOURCES_PATH = os.path.join(
-    os.path.split(os.path.realpath(__file__))[0], 'resources')
+from p2d import file_utils, instrumentation, package_writer, tex_utilities
 
 CHECKER_POLYGON2DOMJUDGE = {
     'fcmp': 'case_sensitive space_change_sensitive',
@@ -44,66 +39,57 @@ RESULT_POLYGON2DOMJUDGE = {
     'do-not-run': None
 }
 
-# Generate the DOMjudge package directory of problem.
+# Generate the DOMjudge package of problem.
 #   problem = dictionary object describing a problem (as generated by
 #             parse_problem_from_polygon)
-#   domjudge = Root directory of the DOMjudge package (initially it is empty)
+#   domjudge_zip = Path of the zip archive of the DOMjudge package.
 #   tex_dir = Directory where pdflatex should be run. It will contain all
 #             .tex and .pdf files (and other byproducts of running pdflatex).
 #             After the execution, it will contain:
 #             - problemname-statement.{tex,pdf}
 #             - problemname-solution.{tex,pdf}
 #   params is a dictionary with keys contest_name, hide_balloon, 
-#   hide_tlml, header_image.
-def generate_domjudge_package(problem, domjudge, tex_dir, params):
-    logging.debug('Creating the DOMjudge package directory \'%s\'.' % domjudge)
-
+#   hide_tlml, header_image, testlib (the path of testlib.h patched for
+#   DOMjudge, see testlib_store).
+#   domjudge_dir = If not None, the DOMjudge package is also written
+#             (extracted) into this directory, which must be empty.
+#
+# The files of the package (tests, checker, solutions, ...) are written into
+# the zip directly from their location in the Polygon package. The entries of
+# the tests are generated while the package is written (see PolygonTests), so
+# that they are never all in memory.
+def generate_domjudge_package(problem, domjudge_zip, tex_dir, params,
+                              domjudge_dir=None):
+    logging.debug('Creating the DOMjudge package \'%s\'.' % domjudge_zip)
+
+    entries = {}    # {arcname: source} of all the files but the tests.
     problem_yaml_data = {}
 
     # Metadata
-    logging.debug('Writing \'domjudge-problem.ini\'.')
-    ini_file = os.path.join(domjudge, 'domjudge-problem.ini')
+    logging.debug('Generating \'domjudge-problem.ini\'.')
     ini_content = [
         'short-name = %s' % problem['name'],
         'name = %s' % problem['title'].replace("'", "`"),
         'timelimit = %s' % problem['timelimit'],
         'color = #%s' % problem['color']
     ]
-    with open(ini_file, 'w', encoding='utf-8') as f:
-        f.writelines(map(lambda s: s + '\n', ini_content))
+    entries['domjudge-problem.ini'] = \
+        ''.join(map(lambda s: s + '\n', ini_content)).encode('utf-8')
     problem_yaml_data['limits'] = {'memory': problem['memorylimit']}
 
-    # Statement
-    tex_utilities.generate_statement_pdf(problem, tex_dir, params)
-    shutil.copyfile(os.path.join(tex_dir, problem['name'] + '-statement.pdf'),
-                    os.path.join(domjudge, 'problem.pdf'))
-
-    # Solution (pdf only in tex_dir, not in the package)
-    tex_utilities.generate_solution_pdf(problem, tex_dir, params)
-
-    # Tests
-    logging.debug('Copying the tests in the DOMjudge package.')
-
-    sample_dir = os.path.join(domjudge, 'data', 'sample')
-    secret_dir = os.path.join(domjudge, 'data', 'secret')
-    pathlib.Path(sample_dir).mkdir(parents=True)
-    pathlib.Path(secret_dir).mkdir(parents=True)
-    for test in problem['tests']:
-        destination = sample_dir if test['is_sample'] else secret_dir
-        shutil.copyfile(
-            test['in'], os.path.join(destination, '%s.in' % test['num']))
-        shutil.copyfile(
-            test['out'], os.path.join(destination, '%s.ans' % test['num']))
+    # Statement and solution (the solution pdf is only in tex_dir, not in the
+    # package). They are compiled in parallel, while the package is built.
+    statement_pdf = tex_utilities.generate_statement_pdf(problem, tex_dir, params)
+    solution_pdf = tex_utilities.generate_solution_pdf(problem, tex_dir, params)
+    entries['problem.pdf'] = \
+        os.path.join(tex_dir, problem['name'] + '-statement.pdf')
 
     # Checker or interactor.
     if problem['interactor'] is not None:
         problem_yaml_data['validation'] = 'custom interactive'
-        pathlib.Path(domjudge, 'output_validators').mkdir()
-        shutil.copyfile(os.path.join(RESOURCES_PATH, 'testlib.h'),
-                        os.path.join(domjudge, 'output_validators', 'testlib.h'))
-        shutil.copyfile(
-                problem['interactor']['source'],
-                os.path.join(domjudge, 'output_validators', 'interactor.cpp'))
+        entries['output_validators/testlib.h'] = params['testlib']
+        entries['output_validators/interactor.cpp'] = \
+            problem['interactor']['source']
     elif problem['checker']['name'] is not None:
         checker_name = problem['checker']['name']
         logging.debug('Standard checker \'%s\'.' % checker_name)
@@ -120,13 +106,8 @@ def generate_domjudge_package(problem, domjudge, tex_dir, params):
     else:
         logging.debug('Custom checker.')
         problem_yaml_data['validation'] = 'custom'
-        pathlib.Path(domjudge, 'output_validators').mkdir()
-        shutil.copyfile(
-                os.path.join(RESOURCES_PATH, 'testlib.h'),
-                os.path.join(domjudge, 'output_validators', 'testlib.h'))
-        shutil.copyfile(
-                problem['checker']['source'],
-                os.path.join(domjudge, 'output_validators', 'checker.cpp'))
+        entries['output_validators/testlib.h'] = params['testlib']
+        entries['output_validators/checker.cpp'] = problem['checker']['source']
 
     # Solutions
     for solution in problem['solutions']:
@@ -134,16 +115,31 @@ def generate_domjudge_package(problem, domjudge, tex_dir, params):
         assert(result in RESULT_POLYGON2DOMJUDGE)
         result = RESULT_POLYGON2DOMJUDGE[result]
         if result is not None:
-            result_dir = os.path.join(domjudge, 'submissions', result)
-            submission_name = os.path.basename(solution['source'])
-            pathlib.Path(result_dir).mkdir(parents=True, exist_ok=True)
-            shutil.copyfile(solution['source'],
-                            os.path.join(result_dir, submission_name))
+            submission_name = file_utils.source_basename(solution['source'])
+            entries['submissions/%s/%s' % (result, submission_name)] = \
+                solution['source']
 
-    # Write problem.yaml
-    yaml_path = os.path.join(domjudge, 'problem.yaml')
+    # problem.yaml
     logging.debug(
-            'Writing into \'%s\' the dictionary %s'
-            % (yaml_path, problem_yaml_data))
-    with open(yaml_path, 'w', encoding='utf-8') as f:
-        yaml.safe_dump(problem_yaml_data, f, default_flow_style=False)
+            'Generating \'problem.yaml\' with the dictionary %s'
+            % problem_yaml_data)
+    entries['problem.yaml'] = yaml.safe_dump(
+        problem_yaml_data, default_flow_style=False).encode('utf-8')
+
+    # The entries of the package (see package_writer).
+    def package_entries():
+        yield from entries.items()
+        for test in problem['tests']:
+            destination = 'data/sample' if test['is_sample'] else 'data/secret'
+            yield ('%s/%s.in' % (destination, test['num']), test['in'])
+            yield ('%s/%s.ans' % (destination, test['num']), test['out'])
+
+    with instrumentation.measure('convert.wait_pdf'):
+        statement_pdf.result()
+    with instrumentation.measure('convert.zip'):
+        package_writer.write_zip(package_entries(), domjudge_zip)
+    if domjudge_dir is not None:
+        with instrumentation.measure('convert.directory'):
+            package_writer.write_directory(package_entries(), domjudge_dir)
+    with instrumentation.measure('convert.wait_pdf'):
+        solution_pdf.result()
@@ -1,5 +1,3 @@
-import requests
-import os
 import re
 import logging
 
@@ -84,56 +82,74 @@ void registerTestlibCmd(int argc, char *argv[]) {
 }'''
 
 
-def add_header(lines, header):
-    return [header] + lines
+# Version of the patch applied by patch_testlib. It must be increased every
+# time the patch changes, so that the patched versions of testlib.h stored by
+# p2d (see testlib_store) are regenerated.
+PATCH_VERSION = 1
 
 
-def replace_exit_code(lines, name, value):
-    for i in range(len(lines)):
-        match = re.fullmatch(r'(# *define +%s +)[a-zA-Z0-9]+( *)' % name, lines[i])
-        if match:
-            lines[i] = match.groups()[0] + str(value) + match.groups()[1]
-    return lines
+# Functions of testlib.h replaced by the patch: {first line: (last line,
+# new function)}. The function is replaced from its first line until the
+# first occurrence of its last line.
+REPLACED_FUNCTIONS = {
+    function.splitlines()[0]: (function.splitlines()[-1], function)
+    for function in [NEW_REGISTER_INTERACTION, NEW_REGISTER_TESTLIB_CMD]
+}
 
+# Lines of testlib.h removed by the patch (after stripping).
+REMOVED_LINES = {'skipBom();'}
 
-def replace_function(lines, function):
-    begin = function.splitlines()[0]
-    end = function.splitlines()[-1]
+# Returns the pattern matching the lines '#define NAME VALUE' of testlib.h,
+# where NAME is one of names. The groups are the part before VALUE, NAME
+# and the part after VALUE.
+def _compile_define_pattern(names):
+    return re.compile(r'(# *define +(%s) +)[a-zA-Z0-9]+( *)'
+                      % '|'.join(map(re.escape, names)))
 
-    state = 0
-    new_lines = []
-    for line in lines:
-        if line == begin:
-            assert(state == 0)
-            state += 1
-        if state != 1:
-            new_lines.append(line)
-        if state == 1 and line == end:
-            state += 1
-            new_lines.append(function)
-    assert(state == 2)
-    return new_lines
+_EXIT_CODES_PATTERN = _compile_define_pattern(NEW_EXIT_CODES)
 
 
-# Download the latest testlib.h version from github and apply a patch
-# to make it compatible with DOMjudge.
+# Returns testlib (the content of testlib.h) with a patch applied to make it
+# compatible with DOMjudge.
+# The values of the exit codes are replaced according to exit_codes, a
+# dictionary {name: value} (by default, NEW_EXIT_CODES).
+#
+# The patch is applied in a single pass over the lines of testlib.h.
 #
 # The applied patch is copied from
 #   https://github.com/cn-xcpc-tools/testlib-for-domjudge.
-def generate_testlib_for_domjudge(dst_path):
-    logging.debug('Downloading testlib.h from github.')
-    req = requests.get(
-        'https://raw.githubusercontent.com/MikeMirzayanov/testlib/master/testlib.h')
-    lines = req.text.splitlines()
+def patch_testlib(testlib, exit_codes=None):
+    define_pattern = _EXIT_CODES_PATTERN
+    if exit_codes is None:
+        exit_codes = NEW_EXIT_CODES
+    elif exit_codes.keys() != NEW_EXIT_CODES.keys():
+        define_pattern = _compile_define_pattern(exit_codes)
 
     logging.debug('Patching testlib.')
-    lines = add_header(lines, HEADER_COMMENT)
-    for exit_code in NEW_EXIT_CODES:
-        lines = replace_exit_code(lines, exit_code, NEW_EXIT_CODES[exit_code])
-    lines = replace_function(lines, NEW_REGISTER_INTERACTION)
-    lines = replace_function(lines, NEW_REGISTER_TESTLIB_CMD)
-    lines = [line for line in lines if line.strip() != 'skipBom();']
-
-    with open(dst_path, 'w') as f:
-        for line in lines:
-            f.write(line + '\n')
+    new_lines = [HEADER_COMMENT]
+    replaced = set()
+    # The last line of the function being replaced (None if no function is
+    # being replaced).
+    function_end = None
+    for line in testlib.splitlines():
+        if function_end is not None:
+            if line == function_end:
+                function_end = None
+            continue
+        if line in REPLACED_FUNCTIONS:
+            assert(line not in replaced)
+            replaced.add(line)
+            function_end, function = REPLACED_FUNCTIONS[line]
+            new_lines.append(function)
+            continue
+        if line.strip() in REMOVED_LINES:
+            continue
+        if line.startswith('#'):
+            match = define_pattern.fullmatch(line)
+            if match:
+                line = match.group(1) + str(exit_codes[match.group(2)]) \
+                    + match.group(3)
+        new_lines.append(line)
+    assert(function_end is None and len(replaced) == len(REPLACED_FUNCTIONS))
+
+    return ''.join(line + '\n' for line in new_lines)
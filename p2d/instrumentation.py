@@ -0,0 +1,157 @@
+import contextlib
+import csv
+import json
+import sys
+import threading
+import time
+import logging
+
+try:
+    import resource
+except ImportError:     # Not available on Windows.
+    resource = None
+
+from p2d._version import __version__
+
+# Instrumentation of the stages of p2d (download, convert, upload, pdflatex,
+# ...), enabled with --report. For each stage of each problem a record is
+# collected with the following fields:
+#   problem = the name of the problem (None if the stage is not relative to
+#             a single problem);
+#   stage = the name of the stage, e.g., 'convert' or 'convert.zip' (the
+#           substages are named after the stage containing them);
+#   document = the name of the tex document (only for the stage 'tex2pdf');
+#   start = when the stage started, in seconds since the start of the run;
+#   wall_time = the duration of the stage, in seconds;
+#   read_bytes, written_bytes = the bytes read and written by the thread
+#           running the stage, from files and sockets (only on Linux, where
+#           they are read from /proc/thread-self/io);
+#   network_received_bytes, network_sent_bytes = the bytes received from and
+#           sent to Polygon and DOMjudge (the body of the requests and of the
+#           responses);
+#   max_rss_kib = the peak resident memory of p2d until the end of the stage
+#           (it is not per stage, as the problems are processed in the same
+#           process);
+#   children_max_rss_kib = the peak resident memory of the subprocesses
+#           (i.e., pdflatex) until the end of the stage.
+# Moreover, a record with stage 'total' describes the whole run.
+FIELDS = ['problem', 'stage', 'document', 'start', 'wall_time', 'read_bytes',
+          'written_bytes', 'network_received_bytes', 'network_sent_bytes',
+          'max_rss_kib', 'children_max_rss_kib']
+
+# If False, measure is a no-op. Use enable to enable it.
+ENABLED = False
+
+_START = None
+_RECORDS = []
+_RECORDS_LOCK = threading.Lock()
+_NETWORK_BYTES = {'received': 0, 'sent': 0}
+# The stack of the records of the stages currently running in each thread.
+_THREAD_STATE = threading.local()
+
+def enable():
+    global ENABLED, _START
+    ENABLED = True
+    _START = time.perf_counter()
+
+def _stack():
+    if not hasattr(_THREAD_STATE, 'records'):
+        _THREAD_STATE.records = []
+    return _THREAD_STATE.records
+
+# Returns the bytes read and written (rchar and wchar) by the current thread
+# (or process), or None if they are not available.
+def _io_counters(path='/proc/thread-self/io'):
+    try:
+        with open(path) as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _max_rss():
+    if resource is None:
+        return None, None
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+# Returns the name of the problem of the innermost stage running in the
+# current thread (or None).
+def current_problem():
+    stack = _stack()
+    return stack[-1]['problem'] if stack else None
+
+# Context manager measuring a stage (see FIELDS). If problem is None, the
+# stage belongs to the problem of the stage containing it.
+@contextlib.contextmanager
+def measure(stage, problem=None, document=None):
+    if not ENABLED:
+        yield
+        return
+
+    record = {
+        'problem': problem if problem is not None else current_problem(),
+        'stage': stage,
+        'document': document,
+        'network_received_bytes': 0,
+        'network_sent_bytes': 0
+    }
+    io_before = _io_counters()
+    start = time.perf_counter()
+    _stack().append(record)
+    try:
+        yield
+    finally:
+        _stack().pop()
+        record['start'] = round(start - _START, 6)
+        record['wall_time'] = round(time.perf_counter() - start, 6)
+        io_after = _io_counters()
+        if io_before is not None and io_after is not None:
+            record['read_bytes'] = io_after[0] - io_before[0]
+            record['written_bytes'] = io_after[1] - io_before[1]
+        record['max_rss_kib'], record['children_max_rss_kib'] = _max_rss()
+        with _RECORDS_LOCK:
+            _RECORDS.append(record)
+
+# Accounts bytes received from (or sent to) the network to all the stages
+# running in the current thread.
+def add_network_bytes(received=0, sent=0):
+    if not ENABLED:
+        return
+    for record in _stack():
+        record['network_received_bytes'] += received
+        record['network_sent_bytes'] += sent
+    with _RECORDS_LOCK:
+        _NETWORK_BYTES['received'] += received
+        _NETWORK_BYTES['sent'] += sent
+
+# Writes the records collected so far into report_path, as csv if its
+# extension is .csv, as json otherwise.
+def write_report(report_path):
+    with _RECORDS_LOCK:
+        records = [dict(record) for record in _RECORDS]
+        total = {
+            'problem': None,
+            'stage': 'total',
+            'document': None,
+            'start': 0,
+            'wall_time': round(time.perf_counter() - _START, 6),
+            'network_received_bytes': _NETWORK_BYTES['received'],
+            'network_sent_bytes': _NETWORK_BYTES['sent']
+        }
+    io_counters = _io_counters('/proc/self/io')
+    if io_counters is not None:
+        total['read_bytes'], total['written_bytes'] = io_counters
+    total['max_rss_kib'], total['children_max_rss_kib'] = _max_rss()
+    records.append(total)
+
+    with open(report_path, 'w', newline='') as f:
+        if report_path.endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump({'version': __version__,
+                       'command': sys.argv,
+                       'records': records}, f, indent=4)
+    logging.info('The report of the run was written to \'%s\'.' % report_path)
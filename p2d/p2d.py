@@ -1,21 +1,33 @@
+import concurrent.futures
+import copy
 import logging
 import os
 import pathlib
+import random
+import requests
 import sys
+import time
 from argparse import ArgumentParser
-import logging
 
 from p2d._version import __version__
-from p2d import (domjudge_api,
+from p2d import (config_store,
+                 domjudge_api,
+                 file_utils,
                  generate_domjudge_package,
-                 generate_testlib_for_domjudge,
+                 instrumentation,
                  parse_polygon_package,
                  polygon_api,
                  p2d_utils,
-                 p2d_utils,
+                 package_cache,
+                 package_writer,
+                 testlib_store,
                  tex_utilities)
-RESOURCES_PATH = os.path.join(
-    os.path.split(os.path.realpath(__file__))[0], 'resources')
+
+# With --watch, the interval between two checks of the Polygon packages is
+# multiplied by a random factor in [1 - WATCH_JITTER, 1 + WATCH_JITTER], and
+# it is doubled after each failed check, up to WATCH_MAX_BACKOFF times.
+WATCH_JITTER = 0.2
+WATCH_MAX_BACKOFF = 16
 
     
 def prepare_argument_parser():
@@ -24,39 +36,70 @@ def prepare_argument_parser():
     parser.add_argument('--problems', nargs='+', metavar='PROBLEM_NAME', help='Use this flag to pass the name of one or more problems if you want to execute the script only on those problems.')
     parser.add_argument('-p', '--polygon', '--import', '--get', '--download', action='store_true', help='Whether the problem packages should be downloaded from Polygon. Otherwise only the packages already present in the system will be considered.')
     parser.add_argument('-c', '--convert', action='store_true', help='Whether the Polygon packages should be converted to DOMjudge packages. Otherwise only the DOMjudge packages already present in the system will be considered.')
+    parser.add_argument('--extract', choices=p2d_utils.EXTRACT_MODES, default='needed', help='Which files of the downloaded Polygon packages are extracted (in \'contest_dir/polygon/problem_name/\'): only the ones necessary for the conversion (needed), or all of them (all). Default: %(default)s.')
+    parser.add_argument('--extracted-package', action='store_true', help='Whether the converted DOMjudge packages should be stored also extracted (in \'contest_dir/domjudge/problem_name/\'). Otherwise only the zip of each package is generated.')
+    parser.add_argument('--link-mode', choices=file_utils.LINK_MODES, default='auto', help='How the files of the Polygon package (tests, checkers, solutions, samples, images) are replicated in the DOMjudge package directory and in the tex directory: as copy-on-write clones (reflink), as hard links (hardlink), or as copies (copy). If the chosen method is not supported, the files are copied. The default (auto) tries reflink, then hardlink, then copy.')
     parser.add_argument('-d', '--domjudge', '--export', '--send', '--upload', action='store_true', help='Whether the DOMjudge packages shall be uploaded to the DOMjudge instance specified in config.yaml.')
+    parser.add_argument('--upload-jobs', type=int, default=domjudge_api.DEFAULT_MAX_UPLOADS, metavar='N', help='Maximum number of DOMjudge packages uploaded at the same time (when many problems are processed concurrently, see --jobs). Default: %(default)s.')
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help='After processing the problems, keep running and check Polygon every SECONDS seconds: the problems with a new package are downloaded (and converted and uploaded, if --convert and --domjudge are passed). Requires --polygon. Stop it with Ctrl-C.')
     parser.add_argument('--from-contest', type=int, metavar='CONTEST_ID', help='Update config.yaml with the problems of the specified Polygon contest.')
     parser.add_argument('--pdf', action='store_true', help='Whether the pdf of the whole problemset and the pdf with all the solutions should be generated. If set, the files are created in \'contest_dir/tex/statements.pdf\' and \'contest_dir/tex/solutions.pdf\'.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N', help='Number of problems processed concurrently (downloading, converting and uploading). The operations relative to a single problem are performed in order and the logs of each problem are printed together. By default, the problems are processed one at a time.')
+    parser.add_argument('--package-cache-dir', metavar='DIR', default=package_cache.default_cache_dir(), help='Directory of the cache of the Polygon packages, which is shared among all contests. A package already present in the cache is not downloaded again from Polygon. Default: \'%(default)s\'.')
+    parser.add_argument('--package-cache-size', type=float, metavar='GiB', default=package_cache.DEFAULT_MAX_SIZE / 2**30, help='Maximum size (in GiB) of the cache of the Polygon packages. When the cache is larger, the least recently used packages are deleted. Set it to 0 to disable the cache. Default: %(default)s.')
+    parser.add_argument('--compression', choices=list(package_writer.COMPRESSIONS), default=package_writer.COMPRESSION, help='Compression method of the zips of the DOMjudge packages. The stored method (no compression) is the fastest, but the zips are larger. Default: %(default)s.')
+    parser.add_argument('--compression-level', type=int, choices=range(10), metavar='{0,...,9}', help='Compression level of the deflated method (1 is the fastest, 9 gives the smallest zips). Default: 6.')
+    parser.add_argument('--zip-jobs', type=int, default=package_writer.ZIP_JOBS, metavar='N', help='Number of threads compressing the files of a DOMjudge package. Default: the number of cores (%(default)s).')
+    parser.add_argument('--tex-jobs', type=int, default=tex_utilities.TEX_JOBS, metavar='N', help='Maximum number of pdflatex processes running at the same time. Default: the number of cores (%(default)s).')
+    parser.add_argument('--report', metavar='PATH', help='Write a report of the run into PATH (as csv if PATH ends with .csv, as json otherwise), with the wall time, the bytes read/written, the bytes sent/received over the network and the peak memory of each stage (download, convert, upload, pdflatex, ...) of each problem.')
     parser.add_argument('--verbosity', choices=['debug', 'info', 'warning'],
                         default='info', help='Verbosity of the logs.')
-    parser.add_argument('--no-cache', action='store_true', help='If set, the various steps (polygon, convert, domjudge) are run even if they would not be necessary (according to the caching mechanism).')
+    parser.add_argument('--no-cache', action='store_true', help='If set, the various steps (polygon, convert, domjudge) are run even if they would not be necessary (according to the caching mechanism). Also the pdfs are compiled even if their sources did not change.')
     parser.add_argument('--clear-dir', action='store_true', help='If set, problems\' data in the contest directory is deleted (as a consequence, the cache is deleted). The file \'config.yaml\' is not deleted.')
     parser.add_argument('--clear-domjudge-ids', action='store_true', help='If set, the DOMjudge IDs saved in config.yaml (for the problems that were uploaded to the DOMjudge server) are deleted. As a consequence, next time the flag `--domjudge` is passed, the problems will be uploaded as new problems to DOMjudge. This should be used either if the DOMjudge server changed, if the DOMjudge contest changed, or if the problems were deleted in the DOMjudge server.')
-    parser.add_argument('--update-testlib', action='store_true', help='Whether to update the local version of testlib (syncing it with the latest version from the official github repository and patching it for DOMjudge).')
+    parser.add_argument('--update-testlib', action='store_true', help='Whether to update the local version of testlib (syncing it with the latest version from the official github repository and patching it for DOMjudge). Otherwise, testlib is downloaded only the first time it is needed.')
+    parser.add_argument('--testlib', metavar='PATH', help='Use the testlib.h at PATH (patching it for DOMjudge, if it is not already patched), instead of the one downloaded from the official github repository. Useful if GitHub is not reachable.')
     
     return parser
 
 
 def p2d(args):
     p2d_utils.configure_logging(args.verbosity)
+    if args.report:
+        instrumentation.enable()
+
+    # Locating testlib.h (downloading and patching it, if necessary).
+    testlib_h = None
+    if args.convert or args.update_testlib:
+        testlib_h = locate_testlib(args)
+
+    file_utils.LINK_MODE = args.link_mode
+
+    if args.jobs < 1 or args.tex_jobs < 1 or args.upload_jobs < 1 \
+       or args.zip_jobs < 1:
+        logging.error('The arguments of --jobs, --tex-jobs, --upload-jobs and --zip-jobs must be positive integers.')
+        exit(1)
+    if args.watch is not None and (not args.polygon or args.watch <= 0):
+        logging.error('The flag --watch requires --polygon and a positive number of seconds.')
+        exit(1)
+    package_writer.COMPRESSION = args.compression
+    package_writer.COMPRESSION_LEVEL = args.compression_level
+    package_writer.ZIP_JOBS = args.zip_jobs
+    tex_utilities.TEX_JOBS = args.tex_jobs
+    tex_utilities.INCREMENTAL = not args.no_cache
 
-    # Downloading and patching testlib.h if necessary.
-    testlib_h = os.path.join(RESOURCES_PATH, 'testlib.h')
-    if not os.path.isfile(testlib_h) or args.update_testlib:
-        generate_testlib_for_domjudge.generate_testlib_for_domjudge(testlib_h)
-        logging.info('The file testlib.h was successfully downloaded and patched. The local version can be found at \'%s\'.' % testlib_h)
-    
     contest_dir = os.path.abspath(args.contest_directory)
 
-    config = p2d_utils.load_config_yaml(contest_dir)
+    store = config_store.ConfigStore(contest_dir)
+    config = store.config
 
     p2d_utils.validate_config_yaml(config)
 
     if not args.polygon and not args.convert and not args.domjudge \
        and args.from_contest is None \
-       and not args.pdf \
+       and not args.pdf and not args.update_testlib \
        and not args.clear_dir and not args.clear_domjudge_ids:
-        logging.error('At least one of the flags --polygon, --convert, --domjudge, --from-contest, --pdf, --clear-dir, --clear-domjudge-ids is necessary.')
+        logging.error('At least one of the flags --polygon, --convert, --domjudge, --from-contest, --pdf, --update-testlib, --clear-dir, --clear-domjudge-ids is necessary.')
         exit(1)
 
     if args.clear_dir:
@@ -65,7 +108,8 @@ def p2d(args):
                 continue
             p2d_utils.remove_problem_data(problem, contest_dir)
 
-        p2d_utils.save_config_yaml(config, contest_dir)
+        store.save()
+        store.flush()
         logging.info('Deleted the problems\' data from \'%s\'.' % contest_dir)
 
     if args.clear_domjudge_ids:
@@ -73,10 +117,12 @@ def p2d(args):
             if args.problems and problem['name'] not in args.problems:
                 continue
             problem['domjudge_server_version'] = -1
+            problem.pop('domjudge_server_fingerprint', None)
             problem.pop('domjudge_id', None)
             problem.pop('domjudge_externalid', None)
 
-        p2d_utils.save_config_yaml(config, contest_dir)
+        store.save()
+        store.flush()
         logging.info('Deleted the DOMjudge IDs from config.yaml.')
         
     if (args.polygon or args.from_contest) \
@@ -101,67 +147,318 @@ def p2d(args):
     pathlib.Path(os.path.join(contest_dir, 'domjudge')).mkdir(exist_ok=True)
     pathlib.Path(os.path.join(contest_dir, 'tex')).mkdir(exist_ok=True)
 
+    polygon = None
+    if args.polygon or args.from_contest:
+        polygon = polygon_api.PolygonClient.from_config(
+            config['polygon'], pool_size=args.jobs)
+
+    domjudge = None
+    if args.domjudge:
+        domjudge = domjudge_api.DomjudgeClient.from_config(
+            config['domjudge'], max_uploads=args.upload_jobs,
+            pool_size=args.jobs)
+
+    packages = None
+    if args.polygon and args.package_cache_size > 0:
+        packages = package_cache.PackageCache(
+            args.package_cache_dir, int(args.package_cache_size * 2**30))
+
     if args.from_contest is not None:
-        p2d_utils.fill_config_from_contest(config, args.from_contest)
-        p2d_utils.save_config_yaml(config, contest_dir)
+        p2d_utils.fill_config_from_contest(config, polygon, args.from_contest)
+        store.save()
+        store.flush()
 
-    # Process the problems, one at a time.
+    # Process the problems, up to args.jobs of them concurrently.
     # For each problem some of the following operations are performed (depending
     # on the command line flags used to run the command):
     #  1. Download the Polygon package (from Polygon).
     #  2. Convert the Polygon package to a DOMjudge package.
     #  3. Upload the DOMjudge package (to a running DOMjudge server).
-    problem_selected_exists = False
+    # The operations relative to a single problem are always performed in this
+    # order.
+    selected_problems = []
     for problem in config['problems']:
         if args.problems and problem['name'] not in args.problems:
             continue
         if not args.polygon and not args.convert and not args.domjudge:
             continue
+        selected_problems.append(problem)
+    problem_selected_exists = len(selected_problems) > 0
 
-        problem_selected_exists = True
-        print('Processing problem \033[96m' + problem['name'] + '\033[39m')     # Cyan
-        p2d_utils.Pol2DomLoggingFormatter.INDENT += 1
-
-        if 'label' not in problem:
-            logging.warning('The problem does not have a label.')
-
-        if args.polygon:
-            if args.no_cache:
-                problem['polygon_version'] = -1
-            p2d_utils.manage_download(
-                config, os.path.join(contest_dir, 'polygon', problem['name']), problem)
-            p2d_utils.save_config_yaml(config, contest_dir)
-
-        if args.convert:
-            if args.no_cache:
-                problem['domjudge_local_version'] = -1
-            p2d_utils.manage_convert(
-                config,
-                os.path.join(contest_dir, 'polygon', problem['name']),
-                os.path.join(contest_dir, 'domjudge', problem['name']),
-                os.path.join(contest_dir, 'tex'),
-                problem)
-            p2d_utils.save_config_yaml(config, contest_dir)
-            
-        if args.domjudge:
-            if args.no_cache:
-                problem['domjudge_server_version'] = -1
-            p2d_utils.manage_domjudge(
-                config, os.path.join(
-                    contest_dir, 'domjudge', problem['name']), problem)
-            p2d_utils.save_config_yaml(config, contest_dir)
-
-        p2d_utils.Pol2DomLoggingFormatter.INDENT -= 1
+    try:
+        run_pipeline(args, store, contest_dir, polygon, domjudge, packages,
+                     testlib_h, selected_problems)
+    finally:
+        store.flush()
 
     if args.problems and not problem_selected_exists:
         logging.warning('None of the problem names specified with --problems appears in config.yaml.')
         return
 
-    if args.problems:
+    if args.pdf and not args.problems:
+        with instrumentation.measure('pdf'):
+            p2d_utils.generate_statements_solutions(config, contest_dir)
+
+    if args.watch is not None:
+        watch(args, store, contest_dir, polygon, domjudge, packages,
+              testlib_h)
+
+# Returns the latest packages of the problems on Polygon, as a dictionary
+# {problem_name: (revision, package_id)} (see
+# PolygonClient.get_latest_package_id). The problems are polled up to jobs
+# at a time, through the pooled session of polygon.
+def poll_latest_packages(polygon, problems, jobs):
+    problems = [problem for problem in problems if 'polygon_id' in problem]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        latest_packages = executor.map(
+            lambda problem: polygon.get_latest_package_id(problem['polygon_id']),
+            problems)
+        return {problem['name']: latest_package
+                for problem, latest_package in zip(problems, latest_packages)}
+
+# Whether, with --watch, the stages selected by args shall be run on problem,
+# given its latest package on Polygon latest_package = (revision, package_id):
+# if the latest package is newer than the local one, or if the conversion or
+# the upload to DOMjudge of the local package failed.
+def needs_processing(args, problem, latest_package):
+    polygon_version = problem.get('polygon_version', -1)
+    if latest_package[0] > polygon_version:
+        return True
+    local_version = problem.get('domjudge_local_version', -1)
+    if args.convert and polygon_version > local_version:
+        return True
+    return args.domjudge and local_version != -1 \
+        and local_version != problem.get('domjudge_server_version', -1)
+
+# Fetches the latest packages of the problems from Polygon and runs the
+# stages selected by args on the problems which need it (see
+# needs_processing).
+# config.yaml is reloaded first, so that the changes made by the user while
+# watching (e.g., a new problem or a different color) are not reverted.
+# Only the errors while polling Polygon are raised; the errors while
+# processing the problems are logged, so that the problem is processed again
+# in the next round.
+def watch_round(args, store, contest_dir, polygon, domjudge, packages,
+                testlib_h):
+    store.reload()
+    p2d_utils.validate_config_yaml(store.config)
+    problems = [problem for problem in store.config['problems']
+                if not args.problems or problem['name'] in args.problems]
+
+    with instrumentation.measure('poll'):
+        latest_packages = poll_latest_packages(polygon, problems, args.jobs)
+
+    changed_problems = [problem for problem in problems
+                        if problem['name'] in latest_packages
+                        and needs_processing(args, problem,
+                                             latest_packages[problem['name']])]
+    if not changed_problems:
+        return
+
+    logging.info('Processing the problems: %s.'
+                 % ', '.join(problem['name'] for problem in changed_problems))
+    try:
+        run_pipeline(args, store, contest_dir, polygon, domjudge, packages,
+                     testlib_h, changed_problems, latest_packages)
+    except requests.exceptions.RequestException as e:
+        logging.error('Error while processing the problems: %s.' % e)
         return
+    # The error was already logged (where exit(1) was called or the assertion
+    # failed).
+    except (SystemExit, AssertionError):
+        return
+    finally:
+        store.flush()
+    if args.pdf and not args.problems:
+        with instrumentation.measure('pdf'):
+            p2d_utils.generate_statements_solutions(store.config, contest_dir)
+
+# Implementation of --watch: runs watch_round every args.watch seconds (with
+# jitter, see WATCH_JITTER), until it is interrupted with Ctrl-C.
+# If Polygon cannot be polled, the error is logged and the interval before
+# the next round is doubled (up to WATCH_MAX_BACKOFF times), so that p2d stays
+# within the rate limits of the Polygon APIs. The other errors (e.g., a
+# package which cannot be converted, or an invalid config.yaml) are logged
+# without changing the interval.
+def watch(args, store, contest_dir, polygon, domjudge, packages, testlib_h):
+    logging.info('Checking the Polygon packages every %s seconds (press '
+                 'Ctrl-C to stop).' % args.watch)
+    failures = 0
+    try:
+        while True:
+            delay = args.watch * min(2**failures, WATCH_MAX_BACKOFF) \
+                * random.uniform(1 - WATCH_JITTER, 1 + WATCH_JITTER)
+            logging.debug('Next check of the Polygon packages in %.1f seconds.'
+                          % delay)
+            time.sleep(delay)
+            try:
+                watch_round(args, store, contest_dir, polygon, domjudge,
+                            packages, testlib_h)
+            except requests.exceptions.RequestException as e:
+                logging.error('Error while checking the Polygon packages: %s.' % e)
+                failures += 1
+            # The error was already logged (where exit(1) was called or the
+            # assertion failed).
+            except (SystemExit, AssertionError):
+                pass
+            else:
+                failures = 0
+    except KeyboardInterrupt:
+        logging.info('Stopped watching Polygon.')
+
+# Returns the path of testlib.h patched for DOMjudge: the one passed with
+# --testlib, or the latest one in the store of testlib.h (see testlib_store).
+# GitHub is contacted only if the store is empty or if --update-testlib is
+# passed; if it cannot be reached, the local version is used (if any).
+def locate_testlib(args):
+    store = testlib_store.TestlibStore(testlib_store.default_store_dir())
+    if args.testlib:
+        if not os.path.isfile(args.testlib):
+            logging.error('The file \'%s\' passed with --testlib does not exist.' % args.testlib)
+            exit(1)
+        return store.import_file(args.testlib)
+
+    testlib_h = None if args.update_testlib else store.path()
+    if testlib_h is not None:
+        return testlib_h
+    try:
+        testlib_h = store.update()
+    except requests.exceptions.RequestException as e:
+        testlib_h = store.path()
+        if testlib_h is None:
+            logging.error('Could not download testlib.h from GitHub (%s). Pass a local copy of testlib.h with --testlib.' % e)
+            exit(1)
+        logging.warning('Could not update testlib.h from GitHub (%s), the local version is used.' % e)
+        return testlib_h
+    logging.info('The file testlib.h was successfully downloaded and patched. The local version can be found at \'%s\'.' % testlib_h)
+    return testlib_h
+
+# Runs the stages (download, convert, upload) selected by args on the given
+# problems, processing up to args.jobs problems concurrently.
+#   polygon is the PolygonClient used to access the Polygon APIs (None if
+#   the packages are not downloaded).
+#   domjudge is the DomjudgeClient used to access the DOMjudge APIs (None if
+#   the packages are not uploaded).
+#   packages is the PackageCache of the Polygon packages (or None).
+#   testlib_h is the path of testlib.h patched for DOMjudge (or None if the
+#   packages are not converted).
+#   latest_packages is a dictionary {problem_name: (revision, package_id)}
+#   with the latest packages on Polygon, if they are already known (see
+#   poll_latest_packages).
+#
+# Each stage works on a private copy of the dictionary describing the problem;
+# once the stage is done the copy is merged back into the config (holding
+# store.lock) and the config is saved (see ConfigStore). The config is saved
+# immediately if a problem was added to the DOMjudge contest, since the
+# DOMjudge ids cannot be recovered if they are lost.
+def run_pipeline(args, store, contest_dir, polygon, domjudge, packages,
+                 testlib_h, problems, latest_packages=None):
+    config = store.config
+    buffered_logs = args.jobs > 1 and len(problems) > 1
+
+    def run_stage(problem, stage):
+        problem_copy = copy.deepcopy(problem)
+        with instrumentation.measure(stage.__name__, problem['name']):
+            stage(problem_copy)
+        with store.lock:
+            registered = problem_copy.get('domjudge_id') != problem.get('domjudge_id')
+            problem.clear()
+            problem.update(problem_copy)
+            store.save()
+            if registered:
+                store.flush()
+
+    def download(problem):
+        if args.no_cache:
+            problem['polygon_version'] = -1
+        p2d_utils.manage_download(
+            polygon, os.path.join(contest_dir, 'polygon', problem['name']), problem,
+            package_cache=packages, extract=args.extract,
+            latest_package=(latest_packages or {}).get(problem['name']))
+
+    def convert(problem):
+        if args.no_cache:
+            problem['domjudge_local_version'] = -1
+        p2d_utils.manage_convert(
+            config,
+            os.path.join(contest_dir, 'polygon', problem['name']),
+            os.path.join(contest_dir, 'domjudge', problem['name']),
+            os.path.join(contest_dir, 'tex'),
+            problem,
+            testlib_h,
+            extracted_package=args.extracted_package)
+
+    def upload(problem):
+        if args.no_cache:
+            problem['domjudge_server_version'] = -1
+            problem.pop('domjudge_server_fingerprint', None)
+        p2d_utils.manage_domjudge(
+            domjudge, os.path.join(
+                contest_dir, 'domjudge', problem['name']), problem)
+
+    # Runs the stages on all the problems.
+    def process_problems(stages, action='Processing'):
+        def process_problem(problem):
+            with p2d_utils.ProblemLogGroup(problem['name'], buffered=buffered_logs,
+                                           action=action):
+                if 'label' not in problem and action == 'Processing':
+                    logging.warning('The problem does not have a label.')
+                for stage in stages:
+                    run_stage(problem, stage)
+
+        if not buffered_logs:
+            for problem in problems:
+                process_problem(problem)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(process_problem, problem)
+                       for problem in problems]
+            # If a problem failed (e.g., exit(1) was called while processing it)
+            # or on Ctrl-C, the problems not yet started are skipped (so that
+            # only the running ones are waited for) and the error is propagated.
+            try:
+                concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            finally:
+                for future in futures:
+                    future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    future.result()
+
+    stages = [stage for stage, selected in [(download, args.polygon),
+                                            (convert, args.convert),
+                                            (upload, args.domjudge)]
+              if selected]
+
+    if not args.domjudge or all('domjudge_id' in problem for problem in problems):
+        process_problems(stages)
+        return
+
+    # Some problems are not yet in the DOMjudge contest. They are added all
+    # together (with a single request) once their packages are ready, and
+    # only then the packages are uploaded.
+    if stages[:-1]:
+        process_problems(stages[:-1])
+
+    to_register = [problem for problem in problems
+                   if 'domjudge_id' not in problem
+                   and problem.get('domjudge_local_version', -1) != -1
+                   and (args.no_cache
+                        or problem['domjudge_local_version']
+                        > problem.get('domjudge_server_version', -1))]
+    if to_register:
+        with store.lock:
+            with instrumentation.measure('register'):
+                registered = domjudge.add_problems_to_contest(to_register)
+            if registered:
+                logging.info('Added the problems %s to the DOMjudge contest.'
+                             % ', '.join(problem['name'] for problem in to_register))
+            store.save()
+            store.flush()
 
-    if args.pdf:
-        p2d_utils.generate_statements_solutions(config, contest_dir)
+    process_problems([upload], action='Uploading')
 
 # Guidelines for error tracing and logging:
 #
@@ -178,7 +475,11 @@ def p2d(args):
 #   in this file).
 def main():
     args = prepare_argument_parser().parse_args()
-    p2d(args)
+    try:
+        p2d(args)
+    finally:
+        if args.report:
+            instrumentation.write_report(args.report)
 
 if __name__ == "__main__":
     main()
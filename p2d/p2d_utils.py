@@ -5,28 +5,32 @@ import re
 import shutil
 import string
 import sys
-import tempfile
+import threading
 import webcolors
+import xml.etree.ElementTree
 import yaml
 import zipfile
 import logging
 from tqdm import tqdm
 
 from p2d._version import __version__
-from p2d import (domjudge_api,
+from p2d import (instrumentation,
                  generate_domjudge_package,
                  generate_testlib_for_domjudge,
+                 package_writer,
                  parse_polygon_package,
-                 polygon_api,
                  tex_utilities)
 RESOURCES_PATH = os.path.join(
     os.path.split(os.path.realpath(__file__))[0], 'resources')
 
+# Thread-local state of the logging. When many problems are processed
+# concurrently, each thread has its own indentation level and (possibly) its
+# own buffer of log messages, see ProblemLogGroup.
+_LOGGING_STATE = threading.local()
+
 # Custom formatter for the console logger handler.
 # Adapted from https://stackoverflow.com/questions/384076/how-can-i-color-python-logging-output
 class Pol2DomLoggingFormatter(logging.Formatter):
-    INDENT = 0
-
     bold_gray = '\033[1;90m'
     bold_green = '\033[1;92m'
     bold_yellow = '\033[1;33m'
@@ -45,12 +49,87 @@ class Pol2DomLoggingFormatter(logging.Formatter):
     def format(self, record):
         level_color, message_color = self.COLORS.get(record.levelno)
         padding = ' ' * (10 - len(record.levelname))
-        log_fmt = '  ' * self.INDENT + level_color + '{levelname}' + self.reset + padding + message_color + '{message}' + self.reset
+        indent = getattr(_LOGGING_STATE, 'indent', 0)
+        log_fmt = '  ' * indent + level_color + '{levelname}' + self.reset + padding + message_color + '{message}' + self.reset
         formatter = logging.Formatter(log_fmt, style='{')
         return formatter.format(record)
 
+# Console logger handler. If the current thread is inside a buffered
+# ProblemLogGroup, the messages are stored in the buffer of the group instead
+# of being printed immediately.
+class Pol2DomLoggingHandler(logging.StreamHandler):
+    def emit(self, record):
+        buffer = getattr(_LOGGING_STATE, 'buffer', None)
+        if buffer is None:
+            super().emit(record)
+            return
+        try:
+            buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+# Context manager grouping the logs relative to a single problem.
+# The header 'Processing problem name' (with action in place of Processing,
+# if given) is printed and the logs emitted (by the current thread) inside the
+# context are indented.
+# If buffered is True, the header and the logs are printed all together when
+# the context is exited, so that the logs of problems processed concurrently
+# are not interleaved.
+class ProblemLogGroup:
+    _print_lock = threading.Lock()
+
+    def __init__(self, problem_name, buffered=False, action='Processing'):
+        self.header = action + ' problem \033[96m' + problem_name + '\033[39m'   # Cyan
+        self.buffered = buffered
+
+    def __enter__(self):
+        if self.buffered:
+            _LOGGING_STATE.buffer = []
+        else:
+            print(self.header)
+        _LOGGING_STATE.indent = getattr(_LOGGING_STATE, 'indent', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _LOGGING_STATE.indent -= 1
+        if self.buffered:
+            buffer = _LOGGING_STATE.buffer
+            _LOGGING_STATE.buffer = None
+            with ProblemLogGroup._print_lock:
+                print(self.header, flush=True)
+                for message in buffer:
+                    sys.stderr.write(message + '\n')
+                sys.stderr.flush()
+        return False
+
+# Returns the state of the logging of the current thread (its indentation
+# level and the buffer of its ProblemLogGroup), to be passed to LogContext.
+def current_log_context():
+    return (getattr(_LOGGING_STATE, 'indent', 0),
+            getattr(_LOGGING_STATE, 'buffer', None))
+
+# Context manager making the logs emitted by the current thread inside the
+# context behave as the ones of the thread whose state of the logging is
+# log_context (see current_log_context): they are indented in the same way
+# and, if that thread is inside a buffered ProblemLogGroup, they are stored
+# in its buffer.
+# It is used by the tasks executed by a thread pool (e.g., the compilations
+# of pdflatex) on behalf of a problem.
+class LogContext:
+    def __init__(self, log_context):
+        self.log_context = log_context
+
+    def __enter__(self):
+        self.saved_log_context = current_log_context()
+        _LOGGING_STATE.indent, _LOGGING_STATE.buffer = self.log_context
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _LOGGING_STATE.indent, _LOGGING_STATE.buffer = self.saved_log_context
+        return False
+
 def configure_logging(verbosity):
-    console_handler = logging.StreamHandler()
+    console_handler = Pol2DomLoggingHandler()
     console_handler.setLevel(eval('logging.' + verbosity.upper()))
     console_handler.setFormatter(Pol2DomLoggingFormatter())
 
@@ -65,15 +144,33 @@ def configure_logging(verbosity):
     requests_log.setLevel(logging.DEBUG)
     requests_log.propagate = True
 
-def manage_download(config, polygon_dir, problem):
+# Modes of extraction of the Polygon package:
+#   needed = only the files necessary for the conversion are extracted (see
+#            parse_polygon_package.required_members);
+#   all = the whole package is extracted;
+#   none = nothing is extracted, the package is converted reading the files
+#          directly from its zip (see parse_polygon_package.PolygonPackage).
+EXTRACT_MODES = ['needed', 'all', 'none']
+
+# Downloads (and extracts) the latest Polygon package of the problem into
+# polygon_dir, if it is newer than the local one.
+#   polygon is the PolygonClient used to access the Polygon APIs.
+#   package_cache is the PackageCache where the packages are looked up before
+#   downloading them (and stored after downloading them), or None.
+#   extract is one of EXTRACT_MODES.
+#   latest_package is the pair (revision, package_id) of the latest package
+#   of the problem (see PolygonClient.get_latest_package_id), if it is
+#   already known; otherwise it is fetched from Polygon.
+def manage_download(polygon, polygon_dir, problem, package_cache=None,
+                    extract='needed', latest_package=None):
     if 'polygon_id' not in problem:
         logging.warning('Skipped because polygon_id is not specified.')
         return
     
     # Check versions
     local_version = problem.get('polygon_version', -1)
-    latest_package = polygon_api.get_latest_package_id(
-        config['polygon']['key'], config['polygon']['secret'], problem['polygon_id'])
+    if latest_package is None:
+        latest_package = polygon.get_latest_package_id(problem['polygon_id'])
 
     logging.debug('For problem %s the selected package is %s.'
                   % (problem['name'], latest_package[1]))
@@ -92,11 +189,19 @@ def manage_download(config, polygon_dir, problem):
 
     pathlib.Path(polygon_dir).mkdir(exist_ok=True)
     
-    # Download the package
+    # Download the package (or fetch it from the cache)
     package_zip = os.path.join(polygon_dir, problem['name'] + '.zip')
-    polygon_api.download_package(
-        config['polygon']['key'], config['polygon']['secret'],
-        problem['polygon_id'], latest_package[1], package_zip)
+    package_key = (problem['polygon_id'], latest_package[0], latest_package[1])
+    if package_cache is not None \
+            and package_cache.get(*package_key, package_zip):
+        logging.info('The Polygon package was found in the local cache.')
+    else:
+        with instrumentation.measure('download.fetch'):
+            polygon.download_package(
+                problem['polygon_id'], latest_package[1], package_zip,
+                revision=latest_package[0])
+        if package_cache is not None and zipfile.is_zipfile(package_zip):
+            package_cache.put(*package_key, package_zip)
 
     # Unzip the package
     if not zipfile.is_zipfile(package_zip):
@@ -105,22 +210,48 @@ def manage_download(config, polygon_dir, problem):
             % package_zip)
         return
 
+    # Removing the files extracted from the previous package.
+    for entry in os.scandir(polygon_dir):
+        if entry.name.startswith(problem['name'] + '.zip'):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+    if extract == 'none':
+        logging.info('Downloaded the Polygon package \'%s\'.' % package_zip)
+        problem['polygon_version'] = latest_package[0]
+        return
+
     with zipfile.ZipFile(package_zip, 'r') as f:
         logging.debug('Unzipping the Polygon package \'%s\'.' % package_zip)
-        f.extractall(polygon_dir)
+        members = f.namelist()
+        if extract == 'needed' and 'problem.xml' in members:
+            problem_xml = xml.etree.ElementTree.fromstring(f.read('problem.xml'))
+            required = parse_polygon_package.required_members(members, problem_xml)
+            logging.debug('Extracting %d files out of %d.'
+                          % (len(required), len(members)))
+            members = required
+        with instrumentation.measure('download.extract'):
+            f.extractall(polygon_dir, members=members)
 
     logging.info('Downloaded and unzipped the Polygon package into '
                  '\'%s\'.' % os.path.join(polygon_dir))
     problem['polygon_version'] = latest_package[0]
 
-# Transforms the Polygon package contained in polygon_dir (already extracted)
-# into an equivalent DOMjudge package in domjudge_dir. In domjudge_dir the
-# package is contained extracted, but also a zip of the package itself is
-# present.
+# Transforms the Polygon package contained in polygon_dir (extracted, or just
+# its zip) into an equivalent DOMjudge package, whose zip is
+# domjudge_dir/name.zip.
+# The checker and the interactor are compiled with testlib_h (a testlib.h
+# patched for DOMjudge).
+# If extracted_package is True, domjudge_dir contains also the package itself
+# (extracted).
 # Moreover, this function creates the two tex files:
 #   tex_dir/problem['name']-statement.tex
 #   tex_dir/problem['name']-solution.tex
-def manage_convert(config, polygon_dir, domjudge_dir, tex_dir, problem):
+def manage_convert(config, polygon_dir, domjudge_dir, tex_dir, problem,
+                   testlib_h, extracted_package=False):
     # Check versions
     polygon_version = problem.get('polygon_version', -1)
     domjudge_version = problem.get('domjudge_local_version', -1)
@@ -138,74 +269,96 @@ def manage_convert(config, polygon_dir, domjudge_dir, tex_dir, problem):
         logging.info('The local DOMjudge package is already up to date.')
         return
 
-    # Parse the Polygon package
-    problem_package = parse_polygon_package.parse_problem_from_polygon(polygon_dir)
-
-    if problem_package['name'] != problem['name']:
-        logging.error('The name of the problem does not coincide with the name of the problem in Polygon, which is \'%s\'.' % problem_package['name'])
-        exit(1)
-
-    # Set some additional properties of the problem (not present in Polygon)
-    missing_keys = list(filter(lambda key: key not in problem or not problem[key],
-                               ['label', 'color', 'author', 'preparation']))
-    if missing_keys:
-        logging.warning('The keys %s are not set in config.yaml for this problem.' % missing_keys)
-    
-    problem_package['label'] = problem.get('label', '?')
-    problem_package['color'] = convert_to_hex(problem.get('color', 'Black'))
-
-    if 'override_time_limit' in problem:
-        problem_package['timelimit'] = problem['override_time_limit']
-
-    if 'override_memory_limit' in problem:
-        problem_package['memorylimit'] = problem['override_memory_limit']
-
-    problem_package['author'] = problem.get('author', '')
-    problem_package['preparation'] = problem.get('preparation', '')
-
-    logging.debug(json.dumps(problem_package, sort_keys=True, indent=4))
-
-    # Generate the tex sources of statement and solution.
-    problem_tex = tex_utilities.generate_statement_tex(problem_package, tex_dir)
-    solution_tex = tex_utilities.generate_solution_tex(problem_package, tex_dir)
-
-    statement_file = problem['name'] + '-statement-content.tex'
-    solution_file = problem['name'] + '-solution-content.tex'
-    
-    with open(os.path.join(tex_dir, statement_file), 'w') as f:
-        f.write(problem_tex)
-    with open(os.path.join(tex_dir, solution_file), 'w') as f:
-        f.write(solution_tex)
+    # The Polygon package is read from polygon_dir if it was extracted there,
+    # otherwise directly from its zip; the tests are always read from the zip
+    # (if present), see parse_polygon_package.PolygonPackage. The files of the
+    # package are read until the DOMjudge package is generated.
+    package_root = polygon_dir
+    package_zip = os.path.join(polygon_dir, problem['name'] + '.zip')
+    if not os.path.isfile(os.path.join(polygon_dir, 'problem.xml')):
+        package_root = package_zip
+    if not zipfile.is_zipfile(package_zip):
+        package_zip = None
+    with parse_polygon_package.PolygonPackage(
+            package_root, package_zip) as polygon_package:
+        # Parse the Polygon package
+        with instrumentation.measure('convert.parse'):
+            problem_package = parse_polygon_package.parse_problem_from_polygon(polygon_package)
+
+        if problem_package['name'] != problem['name']:
+            logging.error('The name of the problem does not coincide with the name of the problem in Polygon, which is \'%s\'.' % problem_package['name'])
+            exit(1)
 
-    # Generate the DOMjudge package.
-    
-    # The following three lines guarantee that in the end domjudge_dir
-    # directory is empty.
-    pathlib.Path(domjudge_dir).mkdir(exist_ok=True)
-    shutil.rmtree(domjudge_dir)
-    pathlib.Path(domjudge_dir).mkdir()
-
-    generate_domjudge_package.generate_domjudge_package(
-        problem_package, domjudge_dir, tex_dir,
-        {
-            'contest_name': config['contest_name'],
-            'hide_balloon': config.get('hide_balloon', False),
-            'hide_tlml': config.get('hide_tlml', False),
-            'header_image': config.get('header_image', '')
-        })
+        # Set some additional properties of the problem (not present in Polygon)
+        missing_keys = list(filter(lambda key: key not in problem or not problem[key],
+                                   ['label', 'color', 'author', 'preparation']))
+        if missing_keys:
+            logging.warning('The keys %s are not set in config.yaml for this problem.' % missing_keys)
+
+        problem_package['label'] = problem.get('label', '?')
+        problem_package['color'] = convert_to_hex(problem.get('color', 'Black'))
+
+        if 'override_time_limit' in problem:
+            problem_package['timelimit'] = problem['override_time_limit']
+
+        if 'override_memory_limit' in problem:
+            problem_package['memorylimit'] = problem['override_memory_limit']
+
+        problem_package['author'] = problem.get('author', '')
+        problem_package['preparation'] = problem.get('preparation', '')
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(json.dumps(problem_package, sort_keys=True, indent=4,
+                                     default=repr))
+
+        # Generate the tex sources of statement and solution.
+        with instrumentation.measure('convert.tex'):
+            problem_tex = tex_utilities.generate_statement_tex(problem_package, tex_dir)
+            solution_tex = tex_utilities.generate_solution_tex(problem_package, tex_dir)
+
+        statement_file = problem['name'] + '-statement-content.tex'
+        solution_file = problem['name'] + '-solution-content.tex'
+
+        with open(os.path.join(tex_dir, statement_file), 'w') as f:
+            f.write(problem_tex)
+        with open(os.path.join(tex_dir, solution_file), 'w') as f:
+            f.write(solution_tex)
+
+        # Generate the DOMjudge package.
+
+        # The following three lines guarantee that in the end domjudge_dir
+        # directory is empty.
+        pathlib.Path(domjudge_dir).mkdir(exist_ok=True)
+        shutil.rmtree(domjudge_dir)
+        pathlib.Path(domjudge_dir).mkdir()
+
+        domjudge_zip = os.path.join(domjudge_dir, problem['name'] + '.zip')
+        with instrumentation.measure('convert.package'):
+            generate_domjudge_package.generate_domjudge_package(
+                problem_package, domjudge_zip, tex_dir,
+                {
+                    'contest_name': config['contest_name'],
+                    'hide_balloon': config.get('hide_balloon', False),
+                    'hide_tlml': config.get('hide_tlml', False),
+                    'header_image': config.get('header_image', ''),
+                    'testlib': testlib_h
+                },
+                domjudge_dir if extracted_package else None)
 
     logging.info('Converted the Polygon package to the DOMjudge package \'%s\'.',
-                 domjudge_dir)
-
-    # Zip the package
-    # A temporary file is necessary since make_archive goes crazy if the .zip
-    # belongs to the directory that must be compressed.
-    with tempfile.NamedTemporaryFile(suffix='.zip', mode='w', encoding='utf-8') as f:
-        shutil.make_archive(f.name[:-4], 'zip', domjudge_dir)
-        shutil.copyfile(f.name, os.path.join(domjudge_dir, problem['name'] + '.zip'))
+                 domjudge_zip)
     problem['domjudge_local_version'] = polygon_version
-
-def manage_domjudge(config, domjudge_dir, problem):
+    problem['domjudge_local_fingerprint'] = \
+        package_writer.zip_fingerprint(domjudge_zip)
+
+# Uploads the DOMjudge package of the problem (contained in domjudge_dir) to
+# the DOMjudge server, if it is newer than the one on the server.
+# A newer package is not uploaded if its content coincides with the one of the
+# package on the server (e.g., the new Polygon revision changed only the
+# validator or the tutorial), which is detected comparing their fingerprints
+# (see package_writer.zip_fingerprint).
+#   domjudge is the DomjudgeClient used to access the DOMjudge APIs.
+def manage_domjudge(domjudge, domjudge_dir, problem):
     # Check versions
     local_version = problem.get('domjudge_local_version', -1)
     server_version = problem.get('domjudge_server_version', -1)
@@ -223,37 +376,46 @@ def manage_domjudge(config, domjudge_dir, problem):
         logging.info('The DOMjudge package on the server is already up to date.')
         return
 
+    local_fingerprint = problem.get('domjudge_local_fingerprint')
+    if 'domjudge_id' in problem and local_fingerprint is not None \
+       and local_fingerprint == problem.get('domjudge_server_fingerprint'):
+        problem['domjudge_server_version'] = local_version
+        logging.info('The content of the DOMjudge package did not change, '
+                     'the package on the server is already up to date.')
+        return
+
         
     # Adding the problem to the contest if it was not already done.
     if 'domjudge_id' not in problem:
-        if not domjudge_api.add_problem_to_contest_api(problem, config['domjudge']):
+        if not domjudge.add_problems_to_contest([problem]):
             logging.error('There was an error while adding the problem '
                           'to the contest in the DOMjudge server.')
             return
 
-    # Sending the problem package to the server.
+    # Sending the problem package to the server (named after the external ID
+    # of the problem).
     assert('domjudge_id' in problem)
     zip_file = os.path.join(domjudge_dir, problem['name'] + '.zip')
-    zip_file_copy = os.path.join(domjudge_dir,
-                                 problem['domjudge_externalid'] + '.zip')
-    shutil.copyfile(zip_file, zip_file_copy)
     
-    if not domjudge_api.update_problem_api(
-            zip_file_copy, problem['domjudge_id'], config['domjudge']):
+    if not domjudge.update_problem(
+            zip_file, problem['domjudge_id'],
+            problem['domjudge_externalid'] + '.zip'):
         logging.error('There was an error while updating the problem '
                       'in the DOMjudge server.')
         return
             
     problem['domjudge_server_version'] = local_version
+    if local_fingerprint is not None:
+        problem['domjudge_server_fingerprint'] = local_fingerprint
+    else:
+        problem.pop('domjudge_server_fingerprint', None)
 
-    logging.info('Updated the DOMjudge package on the server \'%s\', with id = \'%s\'.' % (config['domjudge']['server'], problem['domjudge_id']))
+    logging.info('Updated the DOMjudge package on the server \'%s\', with id = \'%s\'.' % (domjudge.server, problem['domjudge_id']))
 
 # Updates config with the data of the problems in the specified contest.
-def fill_config_from_contest(config, contest_id):
-    contest_problems = polygon_api.get_contest_problems(
-        config['polygon']['key'], config['polygon']['secret'],
-        contest_id
-    )
+#   polygon is the PolygonClient used to access the Polygon APIs.
+def fill_config_from_contest(config, polygon, contest_id):
+    contest_problems = polygon.get_contest_problems(contest_id)
     logging.info('Fetched problems from contest {}.'.format(contest_id))
 
     new_problems = []
@@ -298,16 +460,20 @@ def generate_statements_solutions(config, contest_dir):
     label_and_name.sort()
     sorted_names = [p[1] for p in label_and_name]
     
-    tex_utilities.generate_statements_pdf(
+    # The two documents are compiled in parallel.
+    statements_pdf = tex_utilities.generate_statements_pdf(
             sorted_names,
             os.path.join(contest_dir, 'tex'),
             pdf_generation_params)
 
-    tex_utilities.generate_solutions_pdf(
+    solutions_pdf = tex_utilities.generate_solutions_pdf(
             sorted_names,
             os.path.join(contest_dir, 'tex'),
             pdf_generation_params)
 
+    statements_pdf.result()
+    solutions_pdf.result()
+
     logging.info('Successfully generated \'%s\' and \'%s\'.' %
         (os.path.join(contest_dir, 'tex', 'statements.pdf'),
         os.path.join(contest_dir, 'tex', 'solutions.pdf')))
@@ -334,7 +500,7 @@ def validate_config_yaml(config):
         logging.error('The keys \'contest_name\' and \'problems\' must be present in \'config.yaml\'.')
         exit(1)
     
-    top_level_keys = ['contest_name', 'polygon', 'domjudge', 'front_page_statements', 'front_page_solutions', 'header_image', 'problems', 'hide_balloon', 'hide_tlml']
+    top_level_keys = ['contest_name', 'polygon', 'domjudge', 'front_page_statements', 'front_page_solutions', 'header_image', 'problems', 'hide_balloon', 'hide_tlml', 'separate_state']
 
     wrong_keys = list(set(config.keys()) - set(top_level_keys))
     if wrong_keys:
@@ -342,14 +508,18 @@ def validate_config_yaml(config):
             'The key \'%s\' is not expected as top-level key in \'config.yaml\'. The expected keys are: %s.' % (wrong_keys[0], ', '.join(top_level_keys)))
 
     polygon_keys = ['key', 'secret']
+    polygon_optional_keys = ['address', 'timeout', 'retries']
     domjudge_keys = ['server', 'username', 'password', 'contest_id']
+    domjudge_optional_keys = ['timeout', 'retries']
     if 'polygon' in config and\
-            set(config['polygon'].keys()) != set(polygon_keys):
-        logging.warning('The subdictionary \'polygon\' of \'config.yaml\' must contain they keys: %s.' % ', '.join(polygon_keys))
+            (not set(polygon_keys) <= set(config['polygon'].keys())
+             or not set(config['polygon'].keys()) <= set(polygon_keys + polygon_optional_keys)):
+        logging.warning('The subdictionary \'polygon\' of \'config.yaml\' must contain they keys: %s (and optionally the keys: %s).' % (', '.join(polygon_keys), ', '.join(polygon_optional_keys)))
 
     if 'domjudge' in config and\
-            set(config['domjudge'].keys()) != set(domjudge_keys):
-        logging.warning('The subdictionary \'domjudge\' of \'config.yaml\' must contain they keys: %s.' % ', '.join(domjudge_keys))
+            (not set(domjudge_keys) <= set(config['domjudge'].keys())
+             or not set(config['domjudge'].keys()) <= set(domjudge_keys + domjudge_optional_keys)):
+        logging.warning('The subdictionary \'domjudge\' of \'config.yaml\' must contain they keys: %s (and optionally the keys: %s).' % (', '.join(domjudge_keys), ', '.join(domjudge_optional_keys)))
     
     if 'front_page_statements' in config and not os.path.isfile(config['front_page_statements']):
         logging.error('The \'front_page_statements\' specified in \'config.yaml\' is not a file.')
@@ -363,7 +533,7 @@ def validate_config_yaml(config):
         logging.error('The \'header_image\' specified in \'config.yaml\' is not a file.')
         exit(1)
 
-    problem_keys = ['name', 'label', 'color', 'author', 'preparation', 'override_time_limit', 'override_memory_limit', 'polygon_id', 'polygon_version', 'domjudge_local_version', 'domjudge_server_version', 'domjudge_id', 'domjudge_externalid']
+    problem_keys = ['name', 'label', 'color', 'author', 'preparation', 'override_time_limit', 'override_memory_limit', 'polygon_id', 'polygon_version', 'domjudge_local_version', 'domjudge_server_version', 'domjudge_local_fingerprint', 'domjudge_server_fingerprint', 'domjudge_id', 'domjudge_externalid']
 
     for problem in config['problems']:
         if 'name' not in problem:
@@ -373,10 +543,6 @@ def validate_config_yaml(config):
         if wrong_keys:
             logging.warning('The key \'%s\' in the description of problem \'%s\' in \'config.yaml\' is not expected. The expected keys are: %s.' % (wrong_keys[0], problem['name'], ', '.join(problem_keys)))
 
-def save_config_yaml(config, contest_dir):
-    with open(os.path.join(contest_dir, 'config.yaml'), 'w', encoding='utf-8') as f:
-        yaml.safe_dump(config, f, default_flow_style=False, sort_keys=False)
-
 # Removes from the contest directory all the data relative to the problem and
 # updates accordingly the versioning of the problem.
 # The argument problem is the dictionary describing the problem present in
@@ -386,6 +552,8 @@ def remove_problem_data(problem, contest_dir):
     problem['polygon_version'] = -1
     problem['domjudge_local_version'] = -1
     problem['domjudge_server_version'] = -1
+    problem.pop('domjudge_local_fingerprint', None)
+    problem.pop('domjudge_server_fingerprint', None)
 
     # Delete the directories polygon/problem_name, domjudge/problem_name.
     for dir_name in ['polygon', 'domjudge']:
@@ -401,6 +569,10 @@ def remove_problem_data(problem, contest_dir):
                     problem['name'] + '-' + file_name + '.' + extension)
             if os.path.isfile(file_path):
                 os.remove(file_path)
+        build_dir = tex_utilities.tex_build_dir(
+                os.path.join(contest_dir, 'tex'), problem['name'] + '-' + file_name)
+        if os.path.isdir(build_dir):
+            shutil.rmtree(build_dir)
 
     for sample_in in pathlib.Path(contest_dir, 'tex', 'samples').glob(
             problem['name'] + '*.in'):
@@ -440,6 +612,8 @@ def convert_to_hex(color):
 # Returns a tqdm object that wraps the iterable.
 # The object is itself an iterable that yields the same values,
 # and additionally displays a progress bar which is updated after each iteration.
+# The progress bar is not displayed if the logs of the current thread are
+# buffered.
 def wrap_iterable_in_tqdm(iterable, total, unit_scale=False, desc=None):
     return tqdm(
         iterable,
@@ -452,5 +626,8 @@ def wrap_iterable_in_tqdm(iterable, total, unit_scale=False, desc=None):
         unit='kB',
         unit_scale=unit_scale,
         bar_format='{l_bar}{bar}| \033[33m[ETA: {remaining}, {rate:6.2f} {unit}/s]\033[0m',
-        delay=3
+        delay=3,
+        # Progress bars of concurrently processed problems would garble the
+        # (buffered) logs.
+        disable=getattr(_LOGGING_STATE, 'buffer', None) is not None
     )
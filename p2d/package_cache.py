@@ -0,0 +1,136 @@
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import logging
+
+from p2d._version import __version__
+from p2d import file_utils
+
+# Default maximum size (in bytes) of the cache of Polygon packages.
+DEFAULT_MAX_SIZE = 20 * 2**30
+
+# Returns the default directory of the cache of Polygon packages, which is
+# shared by all the contests of the user.
+def default_cache_dir():
+    return os.path.join(file_utils.cache_home(), 'pol2dom', 'packages')
+
+# Content-addressed cache of Polygon packages, bounded in size.
+#
+# The cache directory contains:
+#   blobs/SHA256.zip = the package zips, named after the sha256 of their
+#                      content;
+#   keys/PROBLEMID-REVISION-PACKAGEID.json = for each package downloaded from
+#                      Polygon, the sha256 and the size of its zip.
+# When the total size of the blobs exceeds max_size, the least recently used
+# ones are evicted. The integrity of a blob is checked (against its sha256)
+# every time it is retrieved.
+class PackageCache:
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.keys_dir = os.path.join(cache_dir, 'keys')
+        self.lock = threading.Lock()
+        pathlib.Path(self.blobs_dir).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(self.keys_dir).mkdir(parents=True, exist_ok=True)
+
+    def _key_path(self, problem_id, revision, package_id):
+        return os.path.join(self.keys_dir, '%s-%s-%s.json'
+                            % (problem_id, revision, package_id))
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256 + '.zip')
+
+    # If the package is in the cache, it is materialized at dst_path (see
+    # file_utils.materialize_file) and True is returned. Otherwise False is
+    # returned.
+    def get(self, problem_id, revision, package_id, dst_path):
+        key_path = self._key_path(problem_id, revision, package_id)
+        with self.lock:
+            try:
+                with open(key_path) as f:
+                    sha256 = json.load(f)['sha256']
+            except (OSError, ValueError, KeyError):
+                return False
+            blob_path = self._blob_path(sha256)
+            if not os.path.isfile(blob_path):
+                os.unlink(key_path)
+                return False
+            # Marking the blob as recently used.
+            os.utime(blob_path)
+
+        if file_utils.file_sha256(blob_path) != sha256:
+            logging.warning('The cached Polygon package \'%s\' is corrupted, '
+                            'it is removed from the cache.' % blob_path)
+            with self.lock:
+                for path in [blob_path, key_path]:
+                    if os.path.isfile(path):
+                        os.unlink(path)
+            return False
+
+        if os.path.lexists(dst_path):
+            os.unlink(dst_path)
+        try:
+            file_utils.materialize_file(blob_path, dst_path)
+        except FileNotFoundError:  # The blob was evicted in the meanwhile.
+            return False
+        logging.debug('Package %s of problem %s found in the cache \'%s\'.'
+                      % (package_id, problem_id, self.cache_dir))
+        return True
+
+    # Adds the package zip src_path to the cache and evicts the least recently
+    # used packages if the cache is too large.
+    def put(self, problem_id, revision, package_id, src_path):
+        sha256 = file_utils.file_sha256(src_path)
+        blob_path = self._blob_path(sha256)
+        with self.lock:
+            if not os.path.isfile(blob_path):
+                with tempfile.NamedTemporaryFile(
+                        dir=self.blobs_dir, suffix='.tmp', delete=False) as f:
+                    tmp_path = f.name
+                file_utils.materialize_file(src_path, tmp_path)
+                os.replace(tmp_path, blob_path)
+            os.utime(blob_path)
+
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=self.keys_dir, suffix='.tmp', delete=False) as f:
+                json.dump({'sha256': sha256,
+                           'size': os.path.getsize(blob_path)}, f)
+            os.replace(f.name, self._key_path(problem_id, revision, package_id))
+
+            self._evict(keep=blob_path)
+
+    # Removes the least recently used blobs (never removing keep) until the
+    # total size of the cache is at most max_size. The keys pointing to
+    # removed blobs are removed too.
+    def _evict(self, keep):
+        blobs = []
+        for blob in pathlib.Path(self.blobs_dir).glob('*.zip'):
+            stat = blob.stat()
+            blobs.append((stat.st_mtime, stat.st_size, str(blob)))
+        total_size = sum(blob[1] for blob in blobs)
+        if total_size <= self.max_size:
+            return
+
+        evicted = set()
+        for _, size, blob_path in sorted(blobs):
+            if total_size <= self.max_size:
+                break
+            if blob_path == keep:
+                continue
+            os.unlink(blob_path)
+            total_size -= size
+            evicted.add(os.path.basename(blob_path)[:-len('.zip')])
+        logging.debug('Evicted %d packages from the cache \'%s\'.'
+                      % (len(evicted), self.cache_dir))
+
+        for key in pathlib.Path(self.keys_dir).glob('*.json'):
+            try:
+                with open(key) as f:
+                    sha256 = json.load(f)['sha256']
+            except (OSError, ValueError, KeyError):
+                continue
+            if sha256 in evicted:
+                key.unlink()
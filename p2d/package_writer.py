@@ -0,0 +1,388 @@
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import pathlib
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+import logging
+
+from p2d._version import __version__
+from p2d import file_utils
+
+# A package (e.g., a DOMjudge package) is described by an iterable of entries
+# (arcname, source), where arcname is the path of a file inside the package
+# (distinct for each entry) and source is either the path of a file on disk,
+# a file_utils.ZipMember, or the content of the file (as bytes). The files are
+# read directly from their original location (e.g., the Polygon package,
+# extracted or not), so that they are never copied into a temporary
+# directory. The entries are iterated only once, while the package is
+# written, hence they can be generated lazily (e.g., the tests, which may be
+# tens of thousands).
+
+# Compression methods of the zip archives written by write_zip, and the one
+# used (which is set from the command line). The stored method (i.e., no
+# compression) is the fastest, but the archives are larger.
+COMPRESSIONS = {'deflated': zipfile.ZIP_DEFLATED, 'stored': zipfile.ZIP_STORED}
+COMPRESSION = 'deflated'
+
+# Compression level (from 0 to 9) of the deflated method; None means the
+# default level of zlib (i.e., 6).
+COMPRESSION_LEVEL = None
+
+# Number of threads compressing the files of a zip archive. Each file is split
+# into chunks of CHUNK_SIZE bytes, which are compressed independently (zlib
+# releases the GIL while compressing) and written in order.
+ZIP_JOBS = os.cpu_count() or 1
+CHUNK_SIZE = 2**20
+
+# Size of the window of the deflate algorithm. The last WINDOW_SIZE bytes of a
+# chunk are used as dictionary when compressing the next one.
+WINDOW_SIZE = 2**15
+
+# Records of a zip archive (see the specification of the zip format,
+# APPNOTE.TXT): local file header, central directory file header, zip64 end of
+# central directory record and locator, end of central directory record. The
+# archives are written with these (and not with zipfile.ZipFile, which can
+# neither copy compressed data nor write data compressed elsewhere).
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_END_RECORD_64 = struct.Struct('<4sQ2H2L4Q')
+_END_LOCATOR_64 = struct.Struct('<4sLQL')
+_END_RECORD = struct.Struct('<4s4H2LH')
+
+# Sizes and offsets larger than ZIP64_LIMIT, and numbers of files larger than
+# ZIP_MAX_FILES, are stored with the zip64 extensions (as zipfile does).
+ZIP64_LIMIT = 2**31 - 1
+ZIP_MAX_FILES = 2**16 - 1
+
+# Version of the zip specification needed to extract a file (2.0, or 4.5 if
+# the zip64 extensions are used) and system which created the archive (3 is
+# Unix, so that external_attr contains the Unix permissions).
+_VERSION = 20
+_VERSION_ZIP64 = 45
+_CREATE_SYSTEM = 3
+
+# Flag bit of the files whose name is encoded in utf-8.
+_FLAG_UTF8 = 0x800
+
+# File of a zip archive being written by _ZipWriter. crc, compress_size and
+# file_size may be unknown (0) when the file is begun.
+class _ZipEntry:
+    def __init__(self, arcname, date_time, external_attr, compress_type,
+                 crc=0, compress_size=0, file_size=0):
+        self.arcname = arcname
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.compress_type = compress_type
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.header_offset = None
+        self.zip64 = False
+
+    def encoded_name(self):
+        try:
+            return self.arcname.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return self.arcname.encode('utf-8'), _FLAG_UTF8
+
+    def dos_date_time(self):
+        year, month, day, hour, minute, second = self.date_time
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        return ((year - 1980) << 9 | month << 5 | day,
+                hour << 11 | minute << 5 | second // 2)
+
+    def local_header(self):
+        name, flag_bits = self.encoded_name()
+        dos_date, dos_time = self.dos_date_time()
+        extra = b''
+        compress_size, file_size = self.compress_size, self.file_size
+        if self.zip64:
+            extra = struct.pack('<2H2Q', 1, 16, file_size, compress_size)
+            compress_size = file_size = 0xffffffff
+        return _LOCAL_HEADER.pack(
+            b'PK\003\004', _VERSION_ZIP64 if self.zip64 else _VERSION, 0,
+            flag_bits, self.compress_type, dos_time, dos_date, self.crc,
+            compress_size, file_size, len(name), len(extra)) + name + extra
+
+    def central_header(self):
+        name, flag_bits = self.encoded_name()
+        dos_date, dos_time = self.dos_date_time()
+        fields = [self.file_size, self.compress_size, self.header_offset]
+        zip64_fields = [field for field in fields if field > ZIP64_LIMIT]
+        file_size, compress_size, header_offset = \
+            [0xffffffff if field > ZIP64_LIMIT else field for field in fields]
+        extra = b''
+        if zip64_fields:
+            extra = struct.pack('<2H%dQ' % len(zip64_fields), 1,
+                                8 * len(zip64_fields), *zip64_fields)
+        version = _VERSION_ZIP64 if zip64_fields else _VERSION
+        return _CENTRAL_HEADER.pack(
+            b'PK\001\002', version, _CREATE_SYSTEM, version, 0, flag_bits,
+            self.compress_type, dos_time, dos_date, self.crc, compress_size,
+            file_size, len(name), len(extra), 0, 0, 0, self.external_attr,
+            header_offset) + name + extra
+
+# Writer of a zip archive into the seekable binary file fp.
+# Each file is written with begin_file, write (its compressed data) and
+# end_file, which rewrites the local header of the file with its final CRC
+# and sizes; close writes the central directory.
+class _ZipWriter:
+    def __init__(self, fp):
+        self.fp = fp
+        self.entries = []
+
+    # As in zipfile, the local header has the zip64 extra field if the file
+    # may be too large for a zip archive without zip64.
+    def begin_file(self, entry):
+        entry.header_offset = self.fp.tell()
+        entry.zip64 = entry.file_size * 1.05 > ZIP64_LIMIT \
+            or entry.compress_size > ZIP64_LIMIT
+        self.fp.write(entry.local_header())
+
+    def write(self, data):
+        self.fp.write(data)
+
+    def end_file(self, entry):
+        if not entry.zip64 and (entry.file_size > ZIP64_LIMIT
+                                or entry.compress_size > ZIP64_LIMIT):
+            raise RuntimeError('The file \'%s\' is too large for a zip '
+                               'archive without zip64.' % entry.arcname)
+        end = self.fp.tell()
+        self.fp.seek(entry.header_offset)
+        self.fp.write(entry.local_header())
+        self.fp.seek(end)
+        self.entries.append(entry)
+
+    def close(self):
+        start = self.fp.tell()
+        for entry in self.entries:
+            self.fp.write(entry.central_header())
+        end = self.fp.tell()
+        count, size = len(self.entries), end - start
+        if count > ZIP_MAX_FILES or size > ZIP64_LIMIT or start > ZIP64_LIMIT:
+            self.fp.write(_END_RECORD_64.pack(
+                b'PK\006\006', _END_RECORD_64.size - 12, _VERSION_ZIP64,
+                _VERSION_ZIP64, 0, 0, count, count, size, start))
+            self.fp.write(_END_LOCATOR_64.pack(b'PK\006\007', 0, end, 1))
+            count = min(count, 0xffff)
+            size = min(size, 0xffffffff)
+            start = min(start, 0xffffffff)
+        self.fp.write(_END_RECORD.pack(b'PK\005\006', 0, 0, count, count,
+                                       size, start, 0))
+
+# Whether the compressed data of the member of another zip archive can be
+# copied as is into a zip archive whose compression is compression (see
+# _copy_zip_member_raw).
+def _can_copy_raw(compression, member):
+    return member.info.compress_type == compression \
+        and not member.info.flag_bits & 0x1     # Not encrypted.
+
+# Copies the compressed data of the member of another zip archive into the
+# archive of writer (under the name arcname), without decompressing it. The
+# CRC and the sizes are known in advance.
+def _copy_zip_member_raw(writer, arcname, member):
+    src_info = member.info
+    entry = _ZipEntry(arcname, src_info.date_time, src_info.external_attr,
+                      src_info.compress_type, src_info.CRC,
+                      src_info.compress_size, src_info.file_size)
+    with open(member.zip_file.filename, 'rb') as src:
+        # Skipping the local header of the member in the source archive.
+        src.seek(src_info.header_offset)
+        header = _LOCAL_HEADER.unpack(src.read(_LOCAL_HEADER.size))
+        if header[0] != b'PK\003\004':
+            raise zipfile.BadZipFile('Bad local header of \'%s\' in \'%s\'.'
+                                     % (src_info.filename,
+                                        member.zip_file.filename))
+        src.seek(header[10] + header[11], os.SEEK_CUR)
+
+        writer.begin_file(entry)
+        remaining = entry.compress_size
+        while remaining > 0:
+            chunk = src.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise zipfile.BadZipFile(
+                    'Truncated member \'%s\' in \'%s\'.'
+                    % (src_info.filename, member.zip_file.filename))
+            writer.write(chunk)
+            remaining -= len(chunk)
+        writer.end_file(entry)
+
+# Returns the _ZipEntry describing the entry (arcname, source) of a package.
+def _zip_entry(arcname, source, compress_type):
+    if isinstance(source, bytes):
+        return _ZipEntry(arcname, time.localtime(time.time())[:6], 0o600 << 16,
+                         compress_type, file_size=len(source))
+    if isinstance(source, file_utils.ZipMember):
+        return _ZipEntry(arcname, source.info.date_time,
+                         source.info.external_attr, compress_type,
+                         file_size=source.info.file_size)
+    st = os.stat(source)
+    return _ZipEntry(arcname, time.localtime(st.st_mtime)[:6],
+                     (st.st_mode & 0xffff) << 16, compress_type,
+                     file_size=st.st_size)
+
+# Yields the content of the source in chunks of CHUNK_SIZE bytes, together
+# with a boolean which is true for the last chunk.
+def _iter_chunks(source):
+    if isinstance(source, bytes):
+        f = io.BytesIO(source)
+    elif isinstance(source, file_utils.ZipMember):
+        f = source.open()
+    else:
+        f = open(source, 'rb')
+    with f:
+        chunk = f.read(CHUNK_SIZE)
+        while True:
+            next_chunk = f.read(CHUNK_SIZE)
+            if not next_chunk:
+                yield chunk, True
+                return
+            yield chunk, False
+            chunk = next_chunk
+
+# Compresses (raw deflate) a chunk of a file, using dictionary (the end of the
+# previous chunk) as dictionary. The chunks of a file are compressed
+# independently and their compressed data is concatenated: each chunk but
+# the last one is terminated by a sync flush, which aligns it to a byte
+# boundary without terminating the deflate stream.
+def _deflate_chunk(chunk, dictionary, level, last):
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(chunk) \
+        + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+# Writes the entries into the archive of writer, with the compression given
+# by COMPRESSION and COMPRESSION_LEVEL.
+# The files are read (and their CRC computed) sequentially. With the deflated
+# method and ZIP_JOBS > 1, their chunks are compressed in parallel by ZIP_JOBS
+# threads; at most 2 * ZIP_JOBS compressed chunks are kept in memory waiting
+# to be written. The members of other zip archives compressed in the same
+# way are copied without decompressing them (see _copy_zip_member_raw).
+def _write_entries(writer, entries):
+    compression = COMPRESSIONS[COMPRESSION]
+    level = zlib.Z_DEFAULT_COMPRESSION if COMPRESSION_LEVEL is None \
+        else COMPRESSION_LEVEL
+    parallel = compression == zipfile.ZIP_DEFLATED and ZIP_JOBS > 1
+    # Actions to be performed in order on writer: ('copy', arcname, member),
+    # ('begin', entry), ('data', entry, crc, size, data, last), where data
+    # is either the compressed chunk or a future returning it.
+    pending = collections.deque()
+    in_flight = 0       # Number of 'data' actions in pending.
+
+    def perform_next():
+        action = pending.popleft()
+        if action[0] == 'copy':
+            _copy_zip_member_raw(writer, action[1], action[2])
+        elif action[0] == 'begin':
+            writer.begin_file(action[1])
+        else:
+            _, entry, crc, size, data, last = action
+            if isinstance(data, concurrent.futures.Future):
+                data = data.result()
+            writer.write(data)
+            entry.crc = crc
+            entry.file_size = size
+            entry.compress_size += len(data)
+            if last:
+                writer.end_file(entry)
+        return action[0]
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=ZIP_JOBS if parallel else 1) as executor:
+        try:
+            for arcname, source in entries:
+                if isinstance(source, file_utils.ZipMember) \
+                        and _can_copy_raw(compression, source):
+                    pending.append(('copy', arcname, source))
+                    continue
+                entry = _zip_entry(arcname, source, compression)
+                pending.append(('begin', entry))
+                crc, size, dictionary = 0, 0, b''
+                compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                              -zlib.MAX_WBITS)
+                for chunk, last in _iter_chunks(source):
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    if compression == zipfile.ZIP_STORED:
+                        data = chunk
+                    elif not parallel:
+                        data = compressor.compress(chunk) \
+                            + (compressor.flush() if last else b'')
+                    else:
+                        data = executor.submit(_deflate_chunk, chunk,
+                                               dictionary, level, last)
+                        dictionary = (dictionary + chunk)[-WINDOW_SIZE:]
+                    pending.append(('data', entry, crc, size, data, last))
+                    in_flight += 1
+                    while in_flight > 2 * ZIP_JOBS:
+                        if perform_next() == 'data':
+                            in_flight -= 1
+            while pending:
+                perform_next()
+        except BaseException:
+            for action in pending:
+                if action[0] == 'data' \
+                        and isinstance(action[4], concurrent.futures.Future):
+                    action[4].cancel()
+            raise
+
+# Writes the package described by entries into the zip archive zip_path.
+# The archive is written to a temporary file in the same directory, which
+# replaces zip_path only when it is complete.
+# The compression of the archive is given by COMPRESSION and
+# COMPRESSION_LEVEL; with the deflated method, the files are compressed by
+# ZIP_JOBS threads.
+def write_zip(entries, zip_path):
+    logging.debug('Writing the package zip \'%s\'.' % zip_path)
+    with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(zip_path)),
+            prefix=os.path.basename(zip_path) + '.', suffix='.tmp',
+            delete=False) as f:
+        tmp_path = f.name
+        try:
+            writer = _ZipWriter(f)
+            _write_entries(writer, entries)
+            writer.close()
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    file_utils.set_replacement_mode(tmp_path, zip_path)
+    os.replace(tmp_path, zip_path)
+
+# Writes the package described by entries (extracted) into directory.
+# The files on disk are materialized (see file_utils.materialize_file).
+def write_directory(entries, directory):
+    logging.debug('Writing the package directory \'%s\'.' % directory)
+    for arcname, source in entries:
+        path = os.path.join(directory, arcname)
+        pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        if isinstance(source, bytes):
+            with open(path, 'wb') as f:
+                f.write(source)
+        else:
+            file_utils.materialize_file(source, path)
+
+# Returns a fingerprint (as hexadecimal string) of the content of the zip
+# archive zip_path, namely the sha256 of the names, CRC32 and sizes of its
+# files. The fingerprint does not depend on the timestamps of the files nor
+# on the compression, hence two zips with the same files have the same
+# fingerprint. The content of the files is not read (the CRC32 are stored in
+# the archive).
+def zip_fingerprint(zip_path):
+    sha256 = hashlib.sha256()
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in sorted(zf.infolist(), key=lambda info: info.filename):
+            sha256.update(('%s\0%08x\0%d\n' % (info.filename, info.CRC,
+                                                  info.file_size)).encode('utf-8'))
+    return sha256.hexdigest()
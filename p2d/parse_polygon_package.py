@@ -4,10 +4,11 @@ import pathlib
 import re
 import sys
 import logging
-from filecmp import cmp
 import xml.etree.ElementTree
+import zipfile
 
 from p2d._version import __version__
+from p2d import file_utils
     
 def parse_samples_explanations(notes):
     lines = notes.splitlines()
@@ -43,10 +44,163 @@ def parse_samples_explanations(notes):
     return explanations
 
 
+# Returns the members of a Polygon package (given the names of all its
+# members and the root of its problem.xml) which are necessary to convert it,
+# i.e., the files read by parse_problem_from_polygon and by the generation of
+# the DOMjudge package and of the statements:
+#   problem.xml, statements/english/, the checker, the interactor and the
+#   solutions.
+# The tests are not necessary, as they are read from the zip of the package
+# (see PolygonPackage), and neither are the generators, the validators, the
+# sources of the tests and the statements in other languages.
+def required_members(members, problem_xml_root):
+    statement_dir = 'statements/english/'
+    required = {'problem.xml'}
+
+    assets = problem_xml_root.find('assets')
+    sources = [assets.find('checker')] + list(assets.iter('solution'))
+    if assets.find('interactor') is not None:
+        sources.append(assets.find('interactor'))
+    for asset in sources:
+        if asset is not None and asset.find('source') is not None:
+            required.add(asset.find('source').attrib['path'])
+
+    return [member for member in members
+            if member in required or member.startswith(statement_dir)]
+
+# Read-only view of a Polygon package, which is either a directory (the
+# package extracted, possibly only in part) or a zip archive (the package
+# itself, which is never extracted). The files of the package are identified
+# by their path relative to the root of the package, with '/' as separator
+# (as in problem.xml).
+# If root is a directory and package_zip is the zip of the same package, the
+# tests are read from package_zip (see test_source), so that their compressed
+# data is copied as is into the DOMjudge zip (see package_writer); the other
+# files are read from root.
+# A package backed by a zip archive must be closed (it is a context manager)
+# once its files are not used anymore.
+class PolygonPackage:
+    def __init__(self, root, package_zip=None):
+        self.root = root
+        self.directory = None if os.path.isfile(root) else root
+        self.zip_file = None
+        if self.directory is None:
+            package_zip = root
+        if package_zip is not None:
+            self.zip_file = zipfile.ZipFile(package_zip)
+            self.members = {info.filename: info
+                            for info in self.zip_file.infolist()
+                            if not info.is_dir()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        if self.zip_file is not None:
+            self.zip_file.close()
+
+    def exists(self, path):
+        if self.directory is None:
+            return path in self.members
+        return os.path.isfile(self.source(path))
+
+    # Returns the file, either as the path of a file on disk or as a
+    # file_utils.ZipMember (see package_writer).
+    def source(self, path):
+        if self.directory is None:
+            return file_utils.ZipMember(self.zip_file, self.members[path])
+        return os.path.join(self.directory, *path.split('/'))
+
+    # Returns the file of a test (see source), which is taken from the zip of
+    # the package whenever it is available.
+    def test_source(self, path):
+        if self.zip_file is not None and path in self.members:
+            return file_utils.ZipMember(self.zip_file, self.members[path])
+        return self.source(path)
+
+    def read(self, path):
+        if self.directory is None:
+            return self.zip_file.read(self.members[path])
+        with open(self.source(path), 'rb') as f:
+            return f.read()
+
+    # Returns the names of the files in the directory.
+    def listdir(self, directory):
+        if self.directory is None:
+            prefix = directory.rstrip('/') + '/'
+            return [name[len(prefix):] for name in self.members
+                    if name.startswith(prefix) and '/' not in name[len(prefix):]]
+        path = self.source(directory)
+        return [f for f in os.listdir(path)
+                if os.path.isfile(os.path.join(path, f))]
+
+    def __str__(self):
+        return self.root
+
+# Lazy sequence of the tests of a Polygon package, see
+# parse_problem_from_polygon.
+#   package = the PolygonPackage
+#   judging_xml = the tag 'judging' of problem.xml
+# The tests are generated while iterating over the testsets of problem.xml,
+# so that the list of all the tests (which may be tens of thousands) is never
+# built. It can be iterated multiple times.
+class PolygonTests:
+    def __init__(self, package, judging_xml):
+        self.package = package
+        self.judging_xml = judging_xml
+
+    def __iter__(self):
+        test_id = 1
+        for testset in self.judging_xml.iter('testset'):
+            # Pretests are processed only to collect samples.
+            is_tests = testset.attrib['name'] == 'tests'
+
+            input_format = testset.find('input-path-pattern').text
+            output_format = testset.find('answer-path-pattern').text
+            # Fetch samples from statements directory (for custom output)
+            sample_output_format = output_format.replace('tests/', 'statements/english/example.')
+
+            for local_id, test in enumerate(testset.iter('test'), start=1):
+                is_sample = 'sample' in test.attrib
+                if not is_tests and not is_sample:
+                    continue
+                yield {
+                    'num': test_id,
+                    'in': self.package.test_source(input_format % local_id),
+                    'out': self.package.source(sample_output_format % local_id) if is_sample else self.package.test_source(output_format % local_id),
+                    'is_sample': is_sample
+                }
+                test_id += 1
+
+    # Checks that the input of each sample coincides with its copy in the
+    # statement (which is the one shown to the contestants). The samples are
+    # few, hence this is done eagerly, before anything is generated.
+    def check_samples(self):
+        for testset in self.judging_xml.iter('testset'):
+            input_format = testset.find('input-path-pattern').text
+            sample_input_format = input_format.replace('tests/', 'statements/english/example.')
+            for local_id, test in enumerate(testset.iter('test'), start=1):
+                if 'sample' not in test.attrib:
+                    continue
+                if not file_utils.same_content(
+                        self.package.test_source(input_format % local_id),
+                        self.package.source(sample_input_format % local_id)):
+                    logging.error('Custom inputs are not supported.') # Because DOMjudge evaluates the same sample inputs that are provided to contestants.
+                    exit(1)
+
+    def __repr__(self):
+        return '<tests of the Polygon package \'%s\'>' % self.package
+
 # Parsing a Polygon package to a Dictionary object.
-#   polygon = path of the root of the Polygon package directory
+#   polygon = the PolygonPackage, or the path of the Polygon package (either
+#             the directory of the extracted package or its zip)
 #
-# The returned dictionary has the following structure ('[]' denotes a list):
+# The returned dictionary has the following structure ('[]' denotes a list,
+# 'file' denotes a file of the package as returned by PolygonPackage.source):
 '''
 color: string (not set in this function as it is not present in Polygon)
 label: string (not set in this function as it is not present in Polygon)
@@ -62,34 +216,37 @@ statement:
     input: string
     output: string
     samples: []
-        in: string
-        out: string
+        in: file
+        out: file
         explanation: string
     tutorial: string
 
-tests: []
+tests: [] (lazy and re-iterable, see PolygonTests)
     num: integer
-    in: string
-    out: string
+    in: file
+    out: file
     is_sample: boolean
 
 checker:
     name: string or None
-    source: string
+    source: file
 
 interactor:
-    source: string or None
+    source: file or None
 
 solutions: []
-    source: string
+    source: file
     result: string
 '''
 def parse_problem_from_polygon(polygon):
+    if not isinstance(polygon, PolygonPackage):
+        polygon = PolygonPackage(polygon)
+
     def pol_path(*path):
-        return os.path.join(polygon, *path)
+        return polygon.source('/'.join(path))
 
-    logging.debug('Parsing the Polygon package directory \'%s\'.' % polygon)
-    if not os.path.isfile(pol_path('problem.xml')):
+    logging.debug('Parsing the Polygon package \'%s\'.' % polygon)
+    if not polygon.exists('problem.xml'):
         logging.error('The directory \'%s\' is not a Polygon package (as it does not contain the file \'problem.xml\'.' % polygon)
         exit(1)
 
@@ -97,7 +254,8 @@ def parse_problem_from_polygon(polygon):
 
     # Metadata
     logging.debug('Parsing \'%s\'' % pol_path('problem.xml'))
-    problem_xml = xml.etree.ElementTree.parse(pol_path('problem.xml'))
+    problem_xml = xml.etree.ElementTree.ElementTree(
+        xml.etree.ElementTree.fromstring(polygon.read('problem.xml')))
     problem['name'] = problem_xml.getroot().attrib['short-name']
     problem['title'] = problem_xml.find('names').find('name').attrib['value']
     for testset in problem_xml.find('judging').findall('testset'):
@@ -115,69 +273,42 @@ def parse_problem_from_polygon(polygon):
     
     # Statement
     problem['statement'] = {}
-    statement_json_path = pol_path(
-        'statements', 'english', 'problem-properties.json')
-    with open(statement_json_path) as f:
-        statement_json = json.load(f)
-        for section in ['legend', 'input', 'output', 'interaction', 'tutorial']:
-            content = statement_json[section]
-            problem['statement'][section] = content if content is not None else ''
-        explanations = parse_samples_explanations(statement_json['notes'])
-
-        sample_id = 1
-        samples = []
-        for sample_json in statement_json['sampleTests']:
-            sample = {
-                'in': pol_path('statements', 'english', sample_json['inputFile']),
-                'out': pol_path('statements', 'english', sample_json['outputFile']),
-                'explanation': explanations.get(sample_id)
-            }
-            samples.append(sample)
-            sample_id += 1
-        problem['statement']['samples'] = samples
+    statement_json = json.loads(
+        polygon.read('statements/english/problem-properties.json'))
+    for section in ['legend', 'input', 'output', 'interaction', 'tutorial']:
+        content = statement_json[section]
+        problem['statement'][section] = content if content is not None else ''
+    explanations = parse_samples_explanations(statement_json['notes'])
+
+    sample_id = 1
+    samples = []
+    for sample_json in statement_json['sampleTests']:
+        sample = {
+            'in': pol_path('statements', 'english', sample_json['inputFile']),
+            'out': pol_path('statements', 'english', sample_json['outputFile']),
+            'explanation': explanations.get(sample_id)
+        }
+        samples.append(sample)
+        sample_id += 1
+    problem['statement']['samples'] = samples
 
     # Detecting images
     problem['statement']['images'] = []
-    statement_path = pol_path('statements', 'english')
     image_extensions = ['.jpg', '.gif', '.png', '.jpeg', '.pdf', '.svg']
-    for f in os.listdir(statement_path):
+    for f in polygon.listdir('statements/english'):
         if any([f.lower().endswith(ext) for ext in image_extensions]):
             problem['statement']['images'].append(
-                    (f, os.path.join(statement_path,f)))
+                    (f, pol_path('statements', 'english', f)))
 
-    # Tests
-    problem['tests'] = []
-    test_id = 1
+    # Tests (generated lazily, see PolygonTests)
     for testset in problem_xml.find('judging').iter('testset'):
         if testset.attrib['name'] not in ['pretests', 'tests']:
             logging.warning('testset \'%s\' ignored: only the testset \'tests\' is exported in DOMjudge (apart from the samples).' % testset.attrib['name'])
-        local_id = 1
-        # Pretests are processed only to collect samples.
-
-        input_format = testset.find('input-path-pattern').text
-        output_format = testset.find('answer-path-pattern').text
-        # Fetch samples from statements directory (for custom output)
-        sample_input_format = input_format.replace('tests/', os.path.join('statements', 'english') + '/example.')
-        sample_output_format = output_format.replace('tests/', os.path.join('statements', 'english') + '/example.')
-
-        for test in testset.iter('test'):
-            if 'sample' in test.attrib and not cmp(pol_path(input_format % local_id), pol_path(sample_input_format % local_id)):
-                logging.error('Custom inputs are not supported.') # Because DOMjudge evaluates the same sample inputs that are provided to contestants.
-                exit(1)
-            t = {
-                'num': test_id,
-                'in': pol_path(input_format % local_id),
-                'out': pol_path(sample_output_format % local_id) if 'sample' in test.attrib else pol_path(output_format % local_id),
-                'is_sample': 'sample' in test.attrib
-            }
-            local_id += 1
-            
-            if testset.attrib['name'] == 'tests' or t['is_sample']:
-                problem['tests'].append(t)
-                test_id += 1
-    if not problem['tests']:
+    problem['tests'] = PolygonTests(polygon, problem_xml.find('judging'))
+    if next(iter(problem['tests']), None) is None:
         logging.error('One of the testset shall be called \'tests\'.')
         exit(1)
+    problem['tests'].check_samples()
 
     # Checker
     checker_xml = problem_xml.find('assets').find('checker')
@@ -186,7 +317,7 @@ def parse_problem_from_polygon(polygon):
         'name': checker_xml.attrib.get('name')
     }
 
-    checker_name = problem['checker']['source']
+    checker_name = checker_xml.find('source').attrib['path']
     if not checker_name.endswith('.cpp') and not checker_name.endswith('.cc'):
         logging.error('Only C++ checkers (using testlib) are supported.')
         exit(1)
@@ -10,89 +10,263 @@ import json
 import logging
 
 from p2d._version import __version__
-from p2d import p2d_utils
+from p2d import instrumentation, p2d_utils
 
 POLYGON_ADDRESS = 'https://polygon.codeforces.com/api/'
 
-# Call to a Polygon API.
-# It returns the response, checking that the return status is ok.
-def call_polygon_api(key, secret, method_name, params, desc=None):
-    params['apiKey'] = key
-    params['time'] = int(time.time())
-    
-    rand = ''.join(random.choices(string.ascii_uppercase, k=6))
-    pref = rand + '/' + method_name + '?'
-    params_arr = []
-    for p in params:
-        params_arr.append((p, params[p]))
-    params_arr.sort()
-    middle = ""
-    for pp in params_arr:
-        if middle:
-            middle += '&'
-        middle += str(pp[0]) + '=' + str(pp[1])
-    suff = '#' + secret
-
-    to_hash = pref + middle + suff
-    params['apiSig'] = rand + hashlib.sha512(to_hash.encode()).hexdigest()
-
-    logging.debug('Sending API request:\n'
-                  + ('\t method = %s\n' % method_name)
-                  + '\t params = %s' % params)
-
-    response = requests.post(POLYGON_ADDRESS + method_name, data=params, stream=True)
-    total = int(response.headers.get('content-length', 0))
-    chunk_size = max(1024, total // 100)    # Keep chunks big enough as streaming many chunks slows down download.
-    content = bytes()                       # Request stream yields chunks in bytes.
-    for chunk in p2d_utils.wrap_iterable_in_tqdm(
-        response.iter_content(chunk_size=chunk_size),
-        total // chunk_size,
-        unit_scale=chunk_size/1024,
-        desc=desc
-    ):
-        if chunk:
-            content += chunk
-    if not response.ok:
-        logging.error('API call to Polygon returned status %s. The content of the response is %s.'
-                      % (response.status_code, response.text))
-
-    assert(response.ok)
-    return content
-
-# Returns the pair (revision, package_id) corresponding to the latest
-# revision of the problem which has a package of type linux ready.
-# It returns (-1, -1) if no valid package is found.
-def get_latest_package_id(key, secret, problem_id):
-    packages_list = json.loads(call_polygon_api(key, secret, 'problem.packages',
-                                                {'problemId': problem_id},
-                                                desc='Fetching latest package ID').decode())
-
-    if packages_list['status'] != 'OK':
-        logging.error('API problem.packages request to Polygon failed with error: %s'              % packages_list['comment'])
-        exit(1)
-
-    revision = -1
-    package_id = -1
-    for p in packages_list['result']:
-        if p['revision'] > revision and p['state'] == 'READY' \
-           and p['type'] == 'linux':
-            revision = p['revision']
-            package_id = p['id']
-    return (revision, package_id)
-
-# Downloads the Polygon package into polygon_zip (as a .zip archive).
-def download_package(key, secret, problem_id, package_id, polygon_zip):
-    package_content = call_polygon_api(key, secret, 'problem.package',
-                                       {'problemId': problem_id,
-                                        'packageId': package_id,
-                                        'type': 'linux'},
-                                        desc='Downloading Polygon package')
-    with open(polygon_zip, "wb") as f:
-        f.write(io.BytesIO(package_content).getbuffer())
-
-# Fetches the list of problems of the specified contest
-# as a dictionary {problem_label: problem_info}.
-def get_contest_problems(key , secret, contest_id):
-    return json.loads(call_polygon_api(
-        key, secret, 'contest.problems', {'contestId': contest_id}, desc='Fetching contest problems'
-    ).decode())['result']
+# Default (connect, read) timeouts, in seconds, of the requests to Polygon.
+DEFAULT_TIMEOUT = (10, 60)
+
+# Default number of retries of a request to Polygon which failed because of
+# a connection error or of a 5xx status code.
+DEFAULT_RETRIES = 3
+
+# Status codes of the responses of Polygon which are worth retrying.
+RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+
+# Exceptions raised while sending a request to Polygon or while streaming the
+# content of its response which are worth retrying (e.g., the connection was
+# reset by the server, or the status code is in RETRIABLE_STATUS_CODES).
+RETRIABLE_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError)
+
+# Client for the Polygon APIs.
+# It owns a requests.Session, so that the connection to Polygon is reused
+# (with a pool of at most pool_size connections, which is relevant when many
+# problems are processed concurrently) across all the API calls.
+# The requests which fail because of a connection error or a 5xx status code
+# are retried up to `retries` times with exponential backoff (by call and
+# download_package; the session itself does not retry). All Polygon APIs are
+# called with POST, but they only read data from Polygon, hence it is safe to
+# retry them.
+class PolygonClient:
+    def __init__(self, key, secret, address=POLYGON_ADDRESS,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 pool_size=10):
+        self.key = key
+        self.secret = secret
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Constructs the client from the subdictionary 'polygon' of config.yaml.
+    # The keys 'key' and 'secret' are mandatory, while 'address' (the url of
+    # the APIs), 'timeout' (in seconds) and 'retries' are optional.
+    @staticmethod
+    def from_config(polygon_config, pool_size=10):
+        timeout = polygon_config.get('timeout')
+        return PolygonClient(
+            polygon_config['key'], polygon_config['secret'],
+            address=polygon_config.get('address', POLYGON_ADDRESS),
+            timeout=DEFAULT_TIMEOUT if timeout is None else (timeout, timeout),
+            retries=polygon_config.get('retries', DEFAULT_RETRIES),
+            pool_size=pool_size)
+
+    # Adds to params the parameters apiKey, time and apiSig required by the
+    # Polygon APIs.
+    def _sign(self, method_name, params):
+        params['apiKey'] = self.key
+        params['time'] = int(time.time())
+
+        rand = ''.join(random.choices(string.ascii_uppercase, k=6))
+        pref = rand + '/' + method_name + '?'
+        params_arr = []
+        for p in params:
+            params_arr.append((p, params[p]))
+        params_arr.sort()
+        middle = ""
+        for pp in params_arr:
+            if middle:
+                middle += '&'
+            middle += str(pp[0]) + '=' + str(pp[1])
+        suff = '#' + self.secret
+
+        to_hash = pref + middle + suff
+        params['apiSig'] = rand + hashlib.sha512(to_hash.encode()).hexdigest()
+
+    # Sends the request to a Polygon API and returns the response (whose
+    # content is not yet downloaded), checking that the return status is ok.
+    # Raises requests.exceptions.HTTPError if the status code is in
+    # RETRIABLE_STATUS_CODES.
+    def _post(self, method_name, params, headers=None):
+        params = dict(params)
+        self._sign(method_name, params)
+
+        logging.debug('Sending API request:\n'
+                      + ('\t method = %s\n' % method_name)
+                      + '\t params = %s' % params)
+
+        response = self.session.post(self.address + method_name, data=params,
+                                     headers=headers, stream=True,
+                                     timeout=self.timeout)
+        if response.status_code in RETRIABLE_STATUS_CODES:
+            response.close()
+            raise requests.exceptions.HTTPError(
+                'API call to Polygon returned status %s'
+                % response.status_code, response=response)
+        if not response.ok:
+            logging.error('API call to Polygon returned status %s. The content of the response is %s.'
+                          % (response.status_code, response.text))
+        assert(response.ok)
+        return response
+
+    # Returns an iterable over the chunks of the content of the response,
+    # displaying a progress bar.
+    def _iter_content(self, response, desc):
+        total = int(response.headers.get('content-length', 0))
+        chunk_size = max(1024, total // 100)    # Keep chunks big enough as streaming many chunks slows down download.
+        for chunk in p2d_utils.wrap_iterable_in_tqdm(
+                response.iter_content(chunk_size=chunk_size),
+                total // chunk_size,
+                unit_scale=chunk_size/1024,
+                desc=desc):
+            instrumentation.add_network_bytes(received=len(chunk))
+            yield chunk
+
+    # Call to a Polygon API.
+    # It returns the content of the response, checking that the return
+    # status is ok.
+    # If the request fails (see RETRIABLE_ERRORS), also while the content is
+    # being received, the whole call is retried.
+    def call(self, method_name, params, desc=None):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._post(method_name, params)
+                content = io.BytesIO()
+                for chunk in self._iter_content(response, desc):
+                    content.write(chunk)
+                return content.getvalue()
+            except RETRIABLE_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                self._wait_before_retry(attempt, e)
+
+    def _wait_before_retry(self, attempt, error):
+        delay = 2 ** attempt
+        logging.debug('API call to Polygon failed with error \'%s\', '
+                      'retrying in %s seconds.' % (error, delay))
+        time.sleep(delay)
+
+    # Returns the pair (revision, package_id) corresponding to the latest
+    # revision of the problem which has a package of type linux ready.
+    # It returns (-1, -1) if no valid package is found.
+    def get_latest_package_id(self, problem_id):
+        packages_list = json.loads(self.call('problem.packages',
+                                             {'problemId': problem_id},
+                                             desc='Fetching latest package ID').decode())
+
+        if packages_list['status'] != 'OK':
+            logging.error('API problem.packages request to Polygon failed with error: %s'              % packages_list['comment'])
+            exit(1)
+
+        revision = -1
+        package_id = -1
+        for p in packages_list['result']:
+            if p['revision'] > revision and p['state'] == 'READY' \
+               and p['type'] == 'linux':
+                revision = p['revision']
+                package_id = p['id']
+        return (revision, package_id)
+
+    # Downloads the Polygon package into polygon_zip (as a .zip archive).
+    # The package is streamed to disk, so the memory usage does not depend on
+    # the size of the package.
+    #
+    # The download is resumable. While it is in progress, the content is
+    # written to polygon_zip.part and the file polygon_zip.part.json stores
+    # the identity of the package (problem_id, package_id, revision) and the
+    # number of bytes received. If the connection breaks (in this call or in
+    # a previous execution), the download restarts from the last received
+    # byte through an HTTP range request. If the server does not honour the
+    # range request, the package is downloaded again from the beginning.
+    # Only when the download is complete polygon_zip.part is renamed to
+    # polygon_zip.
+    def download_package(self, problem_id, package_id, polygon_zip,
+                         revision=None):
+        part_path = polygon_zip + '.part'
+        meta_path = polygon_zip + '.part.json'
+        meta = {'problem_id': problem_id, 'package_id': package_id,
+                'revision': revision, 'bytes': 0}
+
+        offset = 0
+        if os.path.isfile(part_path) and os.path.isfile(meta_path):
+            try:
+                with open(meta_path) as f:
+                    old_meta = json.load(f)
+            except (OSError, ValueError):
+                old_meta = {}
+            if all(old_meta.get(k) == meta[k]
+                   for k in ['problem_id', 'package_id', 'revision']):
+                offset = min(old_meta.get('bytes', 0),
+                             os.path.getsize(part_path))
+        meta['bytes'] = offset
+
+        for attempt in range(self.retries + 1):
+            try:
+                offset = self._download_from(
+                    problem_id, package_id, part_path, meta_path, meta, offset)
+                break
+            except RETRIABLE_ERRORS as e:
+                offset = meta['bytes']
+                if attempt == self.retries:
+                    raise
+                self._wait_before_retry(attempt, e)
+
+        os.replace(part_path, polygon_zip)
+        os.unlink(meta_path)
+
+    # Downloads the package into part_path starting from the byte offset.
+    # meta_path is kept updated with meta (whose key 'bytes' is the number of
+    # bytes of part_path which were received).
+    def _download_from(self, problem_id, package_id, part_path, meta_path,
+                       meta, offset):
+        headers = None
+        if offset > 0:
+            logging.debug('Resuming the download of the Polygon package from '
+                          'byte %s.' % offset)
+            headers = {'Range': 'bytes=%d-' % offset}
+        response = self._post('problem.package',
+                              {'problemId': problem_id,
+                               'packageId': package_id,
+                               'type': 'linux'},
+                              headers=headers)
+
+        content_range = response.headers.get('content-range', '')
+        if offset > 0 and (response.status_code != 206
+                           or not content_range.startswith('bytes %d-' % offset)):
+            logging.debug('The server does not support resuming the download, '
+                          'downloading the Polygon package from the beginning.')
+            offset = 0
+
+        meta['bytes'] = offset
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+        with open(part_path, 'r+b' if offset > 0 else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            try:
+                for chunk in self._iter_content(
+                        response, 'Downloading Polygon package'):
+                    f.write(chunk)
+                    meta['bytes'] += len(chunk)
+            finally:
+                f.flush()
+                with open(meta_path, 'w') as meta_file:
+                    json.dump(meta, meta_file)
+        return meta['bytes']
+
+    # Fetches the list of problems of the specified contest
+    # as a dictionary {problem_label: problem_info}.
+    def get_contest_problems(self, contest_id):
+        return json.loads(self.call(
+            'contest.problems', {'contestId': contest_id}, desc='Fetching contest problems'
+        ).decode())['result']
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import pathlib
+import requests
+import logging
+
+from p2d._version import __version__
+from p2d import file_utils, generate_testlib_for_domjudge
+
+# GitHub API returning the hash of the latest commit of the official
+# repository of testlib.
+TESTLIB_COMMIT_URL = \
+    'https://api.github.com/repos/MikeMirzayanov/testlib/commits/master'
+
+# Url of testlib.h at the commit %s of the official repository.
+TESTLIB_URL = \
+    'https://raw.githubusercontent.com/MikeMirzayanov/testlib/%s/testlib.h'
+
+# (connect, read) timeouts, in seconds, of the requests to GitHub.
+DEFAULT_TIMEOUT = (10, 60)
+
+# Returns the default directory of the store of testlib.h, which is shared by
+# all the contests (and all the installations of p2d) of the user.
+def default_store_dir():
+    return os.path.join(file_utils.cache_home(), 'pol2dom', 'testlib')
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+# Whether testlib (the content of a testlib.h) is already patched for
+# DOMjudge.
+def is_patched(testlib):
+    return testlib.startswith(
+        generate_testlib_for_domjudge.HEADER_COMMENT.splitlines()[0])
+
+# Store of the versions of testlib.h patched for DOMjudge.
+#
+# The store directory contains:
+#   upstream/COMMIT.h = testlib.h as in the commit COMMIT of the official
+#                       repository (or, for a testlib.h passed by the user,
+#                       COMMIT is 'local-' followed by the sha256 of the file);
+#   patched/COMMIT-vVERSION.h = the same file, patched with the version
+#                       VERSION of the patch (see
+#                       generate_testlib_for_domjudge.PATCH_VERSION);
+#   latest.json = the latest commit of the official repository known and the
+#                       ETag of the response of GitHub containing it.
+# The network is accessed only by update(); if the store contains a version
+# of testlib.h, path() never accesses the network. The patched file for a new
+# version of the patch is generated from the upstream one, without
+# downloading it again.
+class TestlibStore:
+    def __init__(self, store_dir, timeout=DEFAULT_TIMEOUT):
+        self.store_dir = store_dir
+        self.timeout = timeout
+        self.upstream_dir = os.path.join(store_dir, 'upstream')
+        self.patched_dir = os.path.join(store_dir, 'patched')
+        self.latest_json = os.path.join(store_dir, 'latest.json')
+        pathlib.Path(self.upstream_dir).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(self.patched_dir).mkdir(parents=True, exist_ok=True)
+
+    def _upstream_path(self, commit):
+        return os.path.join(self.upstream_dir, commit + '.h')
+
+    def _latest(self):
+        try:
+            with open(self.latest_json) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # Returns the path of testlib.h at commit, patched with the current
+    # version of the patch (which is generated if missing).
+    # The upstream testlib.h of the commit must be present in the store.
+    def _patched_path(self, commit):
+        patched_path = os.path.join(
+            self.patched_dir, '%s-v%s.h'
+            % (commit, generate_testlib_for_domjudge.PATCH_VERSION))
+        if not os.path.isfile(patched_path):
+            file_utils.write_atomic(
+                patched_path, generate_testlib_for_domjudge.patch_testlib(
+                    _read(self._upstream_path(commit))))
+        return patched_path
+
+    # Returns the path of the latest version of testlib.h patched for
+    # DOMjudge present in the store, or None if the store does not contain
+    # testlib.h (in this case, call update).
+    def path(self):
+        commit = self._latest().get('commit')
+        if commit is None or not os.path.isfile(self._upstream_path(commit)):
+            return None
+        return self._patched_path(commit)
+
+    # Syncs the store with the latest version of testlib.h of the official
+    # repository and returns the path of its patched version.
+    # GitHub is asked for the latest commit with a conditional request (so
+    # that nothing is transferred if it did not change) and testlib.h is
+    # downloaded only if it is not already present in the store.
+    # Raises requests.exceptions.RequestException if GitHub cannot be
+    # reached.
+    def update(self):
+        latest = self._latest()
+        headers = {'Accept': 'application/vnd.github.sha'}
+        if latest.get('etag') and os.path.isfile(
+                self._upstream_path(latest.get('commit', ''))):
+            headers['If-None-Match'] = latest['etag']
+
+        logging.debug('Fetching the latest commit of testlib from GitHub.')
+        res = requests.get(TESTLIB_COMMIT_URL, headers=headers,
+                           timeout=self.timeout)
+        if res.status_code == 304:
+            logging.debug('testlib.h did not change since the last update.')
+            return self._patched_path(latest['commit'])
+        res.raise_for_status()
+        commit = res.text.strip()
+
+        upstream_path = self._upstream_path(commit)
+        if not os.path.isfile(upstream_path):
+            logging.debug('Downloading testlib.h (commit %s) from GitHub.'
+                          % commit)
+            res_testlib = requests.get(TESTLIB_URL % commit,
+                                       timeout=self.timeout)
+            res_testlib.raise_for_status()
+            file_utils.write_atomic(upstream_path, res_testlib.text)
+
+        file_utils.write_atomic(self.latest_json, json.dumps(
+            {'commit': commit, 'etag': res.headers.get('ETag')}))
+        return self._patched_path(commit)
+
+    # Returns the path of the patched version of the testlib.h at path given
+    # by the user. If it is already patched for DOMjudge, path itself is
+    # returned.
+    def import_file(self, path):
+        testlib = _read(path)
+        if is_patched(testlib):
+            return path
+        commit = 'local-' + hashlib.sha256(testlib.encode()).hexdigest()
+        upstream_path = self._upstream_path(commit)
+        if not os.path.isfile(upstream_path):
+            file_utils.write_atomic(upstream_path, testlib)
+        return self._patched_path(commit)
@@ -1,3 +1,6 @@
+import concurrent.futures
+import hashlib
+import json
 import os
 import pathlib
 import re
@@ -5,9 +8,11 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import logging
 
 from p2d._version import __version__
+from p2d import file_utils, instrumentation, p2d_utils
 RESOURCES_PATH = os.path.join(
     os.path.split(os.path.realpath(__file__))[0], 'resources')
 
@@ -46,34 +51,190 @@ def escape_special_chars(content):
     return content
     
 
+# Maximum number of pdflatex processes running at the same time (set from
+# the command line).
+TEX_JOBS = os.cpu_count() or 1
+
+_TEX_EXECUTOR = None
+_TEX_EXECUTOR_LOCK = threading.Lock()
+
+# Returns the pool executing the pdflatex compilations.
+# The pool is made of threads, but each thread only waits for its pdflatex
+# process, hence at most TEX_JOBS pdflatex processes run concurrently.
+def _tex_executor():
+    global _TEX_EXECUTOR
+    with _TEX_EXECUTOR_LOCK:
+        if _TEX_EXECUTOR is None:
+            _TEX_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=TEX_JOBS, thread_name_prefix='pdflatex')
+        return _TEX_EXECUTOR
+
+# Returns the directory where pdflatex writes the byproducts (.aux, .log, ...)
+# of the compilation of tex_dir/name.tex.
+def tex_build_dir(tex_dir, tex_name):
+    return os.path.join(tex_dir, 'build', tex_name)
+
 # Execute pdflatex on tex_file.
 # tex_file is a .tex file
+# pdflatex runs in the directory of tex_file (so that the relative paths of
+# images and of \input files are resolved there), but each tex file has its
+# own build directory (see tex_build_dir), so that the byproducts of
+# different compilations never collide. The pdf is then moved next to
+# tex_file.
 def tex2pdf(tex_file):
     logging.debug('Executing pdflatex on \'%s\'.' % tex_file)
     if not tex_file.endswith('.tex'):
         logging.error('The argument tex_file=\'%s\' passed to tex2pdf is not a .tex file.' % tex_file)
         exit(1)
     
-    tex_dir = os.path.dirname(tex_file)
+    tex_dir = os.path.dirname(os.path.abspath(tex_file))
     tex_name = os.path.basename(tex_file)[:-4] # Without extension
+    build_dir = tex_build_dir(tex_dir, tex_name)
+    pathlib.Path(build_dir).mkdir(parents=True, exist_ok=True)
     command_as_list = ['pdflatex', '-interaction=nonstopmode', '--shell-escape',
-                       '-output-dir=' + tex_dir, '-jobname=%s' % tex_name,
-                       tex_file]
+                       '-output-dir=' + build_dir, '-jobname=%s' % tex_name,
+                       os.path.abspath(tex_file)]
     logging.debug('pdflatex command = ' + ' '.join(command_as_list))
     pdflatex = subprocess.run(command_as_list, stdout=subprocess.PIPE,
-                              shell=False)
+                              shell=False, cwd=tex_dir)
     if pdflatex.returncode != 0:
         logging.error(' '.join(command_as_list) + '\n'
                       + pdflatex.stdout.decode("utf-8"))
         logging.error('The pdflatex command returned an error.')
         exit(1)
 
-    tex_pdf = os.path.join(tex_dir, tex_name + '.pdf')
+    shutil.copyfile(os.path.join(build_dir, tex_name + '.pdf'),
+                    os.path.join(tex_dir, tex_name + '.pdf'))
+
+# Whether the compilation of a tex file is skipped when neither the tex file
+# nor the files it references changed since the last successful compilation
+# (set from the command line).
+INCREMENTAL = True
+
+# Name of the file, in the tex directory, storing the digests (see
+# tex_digest) of the last successful compilation of each tex file.
+BUILD_MANIFEST = 'build-manifest.json'
+
+_BUILD_MANIFEST_LOCK = threading.Lock()
+
+# Extensions which may be omitted in the paths of the files referenced by a
+# tex file: the ones of \input and \sample, and the ones of the images
+# supported by pdflatex (which are tried by \includegraphics).
+DIGEST_EXTENSIONS = ['', '.tex', '.in', '.out',
+                     '.pdf', '.png', '.jpg', '.jpeg', '.eps',
+                     '.PDF', '.PNG', '.JPG', '.JPEG', '.EPS']
+
+# Returns the sha256 of the content of tex_file and of all the files it
+# references (recursively for the referenced .tex files): samples, images,
+# header image, front pages, \input files.
+# A file is considered referenced if its path, relative to the directory of
+# tex_file or absolute, appears as an argument {...} of a command (possibly
+# without one of the extensions DIGEST_EXTENSIONS, as it happens for \input,
+# \sample and \includegraphics).
+def tex_digest(tex_file):
+    tex_dir = os.path.dirname(os.path.abspath(tex_file))
+    digest = hashlib.sha256()
+    visited = set()
+
+    def visit(path):
+        if path in visited:
+            return
+        visited.add(path)
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest.update(path.encode() + b'\0' + hashlib.sha256(content).digest())
+        if not path.endswith('.tex'):
+            return
+        arguments = re.findall(r'\{([^{}\n]+)\}',
+                               content.decode('utf-8', errors='replace'))
+        for argument in arguments:
+            for extension in DIGEST_EXTENSIONS:
+                candidate = os.path.join(tex_dir, argument.strip() + extension)
+                if os.path.isfile(candidate):
+                    visit(os.path.normpath(candidate))
+
+    visit(os.path.abspath(tex_file))
+    return digest.hexdigest()
+
+def _load_build_manifest(tex_dir):
+    try:
+        with open(os.path.join(tex_dir, BUILD_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _update_build_manifest(tex_dir, tex_name, digest):
+    with _BUILD_MANIFEST_LOCK:
+        manifest = _load_build_manifest(tex_dir)
+        manifest[tex_name] = digest
+        manifest_path = os.path.join(tex_dir, BUILD_MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+# Maximum number of pdflatex passes performed on a tex file.
+MAX_PASSES = 4
+
+# Reads the .aux file produced by pdflatex (None if it does not exist).
+def _read_aux(aux_path):
+    try:
+        with open(aux_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+# Runs pdflatex on tex_file until the .aux file does not change anymore (as
+# latexmk does), so that cross-references and commands depending on the
+# previous pass (e.g., \insertblankpageifnecessary) are resolved.
+# At most MAX_PASSES passes are performed.
+def tex2pdf_until_convergence(tex_file):
+    tex_dir = os.path.dirname(os.path.abspath(tex_file))
+    tex_name = os.path.basename(tex_file)[:-4]
+    aux_path = os.path.join(tex_build_dir(tex_dir, tex_name), tex_name + '.aux')
+
+    for passes in range(1, MAX_PASSES + 1):
+        aux_before = _read_aux(aux_path)
+        tex2pdf(tex_file)
+        if _read_aux(aux_path) == aux_before:
+            break
+    else:
+        logging.warning('The .aux file of \'%s\' did not converge after %d '
+                        'pdflatex passes.' % (tex_file, MAX_PASSES))
+    logging.debug('Compiled \'%s\' with %d pdflatex passes.'
+                  % (tex_file, passes))
+
+# Schedules the compilation of tex_file (see tex2pdf_until_convergence).
+# Returns a concurrent.futures.Future, whose result() waits for the
+# compilation to finish (and raises if the compilation failed).
+# If INCREMENTAL is set and the digest of tex_file (see tex_digest) is the
+# same as in the last successful compilation, pdflatex is not executed.
+# The logs of the compilation belong to the ProblemLogGroup of the caller (if
+# any), as if the compilation were performed by the calling thread.
+def submit_tex2pdf(tex_file):
+    tex_dir = os.path.dirname(os.path.abspath(tex_file))
+    tex_name = os.path.basename(tex_file)[:-4]
+
+    problem = instrumentation.current_problem()
+    log_context = p2d_utils.current_log_context()
+
+    def compile():
+        with p2d_utils.LogContext(log_context):
+            digest = tex_digest(tex_file)
+            if INCREMENTAL \
+                    and _load_build_manifest(tex_dir).get(tex_name) == digest \
+                    and os.path.isfile(os.path.join(tex_dir, tex_name + '.pdf')):
+                logging.debug('The pdf of \'%s\' is up to date.' % tex_file)
+                return
+            with instrumentation.measure('tex2pdf', problem, document=tex_name):
+                tex2pdf_until_convergence(tex_file)
+            _update_build_manifest(tex_dir, tex_name, digest)
+    return _tex_executor().submit(compile)
 
 # Returns a string containing the tex of the statement (only what shall go
 # inside \begin{document} \end{document}).
-# The samples (.in/.out) and the images are copied in tex_dir/samples and
-# tex_dir/images respectively.
+# The samples (.in/.out) and the images are materialized (see
+# file_utils.materialize_file) in tex_dir/samples and tex_dir/images
+# respectively.
 def generate_statement_tex(problem, tex_dir):
     pathlib.Path(os.path.join(tex_dir, 'samples')).mkdir(exist_ok=True)
     pathlib.Path(os.path.join(tex_dir, 'images')).mkdir(exist_ok=True)
@@ -87,8 +248,8 @@ def generate_statement_tex(problem, tex_dir):
         sample_path = os.path.join(tex_dir, 'samples',
                                    problem['name'] + '-' + str(sample_cnt))
 
-        shutil.copyfile(sample['in'], sample_path + '.in')
-        shutil.copyfile(sample['out'], sample_path + '.out')
+        file_utils.materialize_file(sample['in'], sample_path + '.in')
+        file_utils.materialize_file(sample['out'], sample_path + '.out')
 
         samples_tex += '\\sample{%s}\n' % sample_path
 
@@ -135,14 +296,14 @@ def generate_statement_tex(problem, tex_dir):
         statement_template = statement_template.replace(
             '{' + image[0] + '}', 
             '{' + image_unique_name + '}')
-        shutil.copyfile(image[1], os.path.join(tex_dir, image_unique_name))
+        file_utils.materialize_file(image[1], os.path.join(tex_dir, image_unique_name))
 
     return statement_template
 
 
 # Returns a string containing the tex source of the solution (only what shall
 # go inside \begin{document} \end{document}).
-# The images are copied in tex_dir/images.
+# The images are materialized in tex_dir/images.
 def generate_solution_tex(problem, tex_dir):
     with open(os.path.join(RESOURCES_PATH, 'solution_template.tex')) as f:
         solution_template = f.read()
@@ -165,7 +326,7 @@ def generate_solution_tex(problem, tex_dir):
         image_unique_name = os.path.join(
             'images', problem['name'] + '-' + image[0])
         solution_template = solution_template.replace(image[0], image_unique_name)
-        shutil.copyfile(image[1], os.path.join(tex_dir, image_unique_name))
+        file_utils.materialize_file(image[1], os.path.join(tex_dir, image_unique_name))
 
     return solution_template
 
@@ -177,15 +338,21 @@ def generate_solution_tex(problem, tex_dir):
 # 1. Fill document_template.tex document tag with document_content;
 # 2. Replace the placeholders in params using params;
 # 3. Save the resulting tex in tex_file;
-# 4. Compile tex_file. If tex_file = 'path/name.tex', the pdf file produced is
-#    'path/name.pdf'.
+# 4. Schedule the compilation of tex_file (see submit_tex2pdf).
+#    If tex_file = 'path/name.tex', the pdf file produced is 'path/name.pdf'.
+#
+# Returns the concurrent.futures.Future of the compilation (see
+# submit_tex2pdf).
 #
 # params is a dictionary with keys contest_name, hide_balloon, hide_tlml,
 # header_image.
 def compile_document_template(document_content, tex_file, params):
+    header_image = params['header_image']
+    if header_image:
+        header_image = os.path.abspath(header_image)
     replacements_document = {
         'CONTESTNAME': params['contest_name'],
-        'HEADERIMAGE': params['header_image'],
+        'HEADERIMAGE': header_image,
         'SHOWBALLOON': 0 if params['hide_balloon'] else 1,
         'SHOWTLML': 0 if params['hide_tlml'] else 1,
         'DOCUMENTCONTENT': document_content
@@ -200,32 +367,35 @@ def compile_document_template(document_content, tex_file, params):
     with open(tex_file, 'w') as f:
         f.write(document_template)
 
-    tex2pdf(tex_file)
+    return submit_tex2pdf(tex_file)
 
 # Produces problemname-statement.{tex,pdf}, which are respectively the tex source
 # and the pdf of the statement, in the directory tex_dir.
+# The pdf is compiled asynchronously, the returned Future must be waited.
 #   params is a dictionary with keys contest_name, hide_balloon, 
 #   hide_tlml, header_image.
 def generate_statement_pdf(problem, tex_dir, params):
     statement_tex = generate_statement_tex(problem, tex_dir)
-    compile_document_template(
+    return compile_document_template(
         statement_tex,
         os.path.join(tex_dir, problem['name'] + '-statement.tex'),
         params)
 
 # Produces problemname-solution.{tex,pdf}, which are respectively the tex source
 # and the pdf of the solution, in the directory tex_dir.
+# The pdf is compiled asynchronously, the returned Future must be waited.
 #   params is a dictionary with keys contest_name, hide_balloon, 
 #   hide_tlml, header_image.
 def generate_solution_pdf(problem, tex_dir, params):
     solution_tex = generate_solution_tex(problem, tex_dir)
-    compile_document_template(
+    return compile_document_template(
         solution_tex,
         os.path.join(tex_dir, problem['name'] + '-solution.tex'),
         params)
 
 # Produces the complete problem set of a contest and saves it as
 # tex_dir/statements.pdf.
+# The pdf is compiled asynchronously, the returned Future must be waited.
 #   problems is a list of problem names, in the order they shall appear.
 #   tex_dir must contain problem-statement-content.tex for each problem in
 #   problems.
@@ -248,15 +418,16 @@ def generate_statements_pdf(problems, tex_dir, params):
         problemset_tex += '\\input{%s-statement-content.tex}\n' % problem
         problemset_tex += '\\insertblankpageifnecessary\n\n'
 
-    # Executing pdflatex twice because otherwise the command
-    # \insertblankpageifnecessary does not produce the correct output.
-    for _ in range(2):
-        compile_document_template(
-                problemset_tex,
-                os.path.join(tex_dir, 'statements.tex'),
-                params)
+    # The command \insertblankpageifnecessary produces the correct output
+    # only from the second pdflatex pass, which is performed if the .aux
+    # file changed (see tex2pdf_until_convergence).
+    return compile_document_template(
+            problemset_tex,
+            os.path.join(tex_dir, 'statements.tex'),
+            params)
 
 # Produces the complete editorial of a contest and saves it as tex_dir/solutions.pdf.
+# The pdf is compiled asynchronously, the returned Future must be waited.
 #   problems is a list of problem names, in the order they shall appear.
 #   tex_dir must contain problemname-solution-content.tex for each problem
 #   in problems.
@@ -278,7 +449,7 @@ def generate_solutions_pdf(problems, tex_dir, params):
         solutions_tex += '\\input{%s-solution-content.tex}\n' % problem
         solutions_tex += '\\clearpage\n'
     
-    compile_document_template(
+    return compile_document_template(
             solutions_tex,
             os.path.join(tex_dir, 'solutions.tex'),
             params)
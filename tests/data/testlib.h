@@ -0,0 +1,173 @@
+/*
+ * It is strictly recommended to include "testlib.h" before any other include
+ * in your code. In this case testlib overrides compiler specific "random()".
+ *
+ * This file is a reduced snapshot of testlib.h (the parts touched by the
+ * patch for DOMjudge, and some context around them).
+ */
+
+#ifndef _TESTLIB_H_
+#define _TESTLIB_H_
+
+#define VERSION "0.9.41"
+
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+
+#ifndef OK_EXIT_CODE
+#   ifdef CONTESTER
+#       define OK_EXIT_CODE 0xAC
+#   else
+#       define OK_EXIT_CODE 0
+#   endif
+#endif
+
+#ifndef WA_EXIT_CODE
+#   ifdef EJUDGE
+#       define WA_EXIT_CODE 5
+#   elif defined(CONTESTER)
+#       define WA_EXIT_CODE 0xAB
+#   else
+#       define WA_EXIT_CODE 1
+#   endif
+#endif
+
+#ifndef PE_EXIT_CODE
+#   ifdef EJUDGE
+#       define PE_EXIT_CODE 4
+#   elif defined(CONTESTER)
+#       define PE_EXIT_CODE 0xAA
+#   else
+#       define PE_EXIT_CODE 2
+#   endif
+#endif
+
+#ifndef FAIL_EXIT_CODE
+#   ifdef EJUDGE
+#       define FAIL_EXIT_CODE 6
+#   elif defined(CONTESTER)
+#       define FAIL_EXIT_CODE 0xA3
+#   else
+#       define FAIL_EXIT_CODE 3
+#   endif
+#endif
+
+#ifndef DIRT_EXIT_CODE
+#   ifdef EJUDGE
+#       define DIRT_EXIT_CODE 6
+#   else
+#       define DIRT_EXIT_CODE 4
+#   endif
+#endif
+
+#ifndef POINTS_EXIT_CODE
+#   define POINTS_EXIT_CODE 7
+#endif
+
+#ifndef UNEXPECTED_EOF_EXIT_CODE
+#   define UNEXPECTED_EOF_EXIT_CODE 8
+#endif
+
+void InStream::skipBom() {
+    const std::string utf8Bom = "\xEF\xBB\xBF";
+    size_t index = 0;
+    while (index < utf8Bom.size() && curChar() == utf8Bom[index]) {
+        index++;
+        skipChar();
+    }
+}
+
+void registerInteraction(int argc, char *argv[]) {
+    __testlib_ensuresPreconditions();
+    __testlib_set_testset_and_group(argc, argv);
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _interactor;
+    __testlib_set_binary(stdin);
+
+    if (argc > 1 && !strcmp("--help", argv[1]))
+        __testlib_help();
+
+    if (argc < 3 || argc > 6) {
+        quit(_fail, std::string("Program must be run with the following arguments: ") +
+                    std::string("<input-file> <output-file> [<report-file> [<-appes>]]") +
+                    "\nUse \"--help\" to get help information");
+    }
+
+    if (argc <= 4) {
+        resultName = "";
+        appesMode = false;
+    }
+
+    inf.init(argv[1], _input);
+
+    tout.open(argv[2], std::ios_base::out);
+    if (tout.fail() || !tout.is_open())
+        quit(_fail, std::string("Can not write to the test-output-file '") + argv[2] + std::string("'"));
+
+    ouf.init(stdin, _output);
+
+    if (argc >= 4)
+        ans.init(argv[3], _answer);
+    else
+        ans.name = "unopened answer stream";
+}
+
+void registerValidation() {
+    __testlib_ensuresPreconditions();
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _validator;
+
+    __testlib_set_binary(stdin);
+    __testlib_set_binary(stdout);
+    __testlib_set_binary(stderr);
+
+    inf.init(stdin, _input);
+    inf.strict = true;
+}
+
+void registerTestlibCmd(int argc, char *argv[]) {
+    __testlib_ensuresPreconditions();
+    __testlib_set_testset_and_group(argc, argv);
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _checker;
+    __testlib_set_binary(stdin);
+
+    std::vector<std::string> args(1, argv[0]);
+    checker.initialize();
+
+    if (args.size() < 4 || args.size() > 6) {
+        quit(_fail, std::string("Program must be run with the following arguments: ") +
+                    std::string("[--testset testset] [--group group] <input-file> <output-file> <answer-file> [<report-file> [<-appes>]]") +
+                    "\nUse \"--help\" to get help information");
+    }
+
+    if (args.size() == 4) {
+        resultName = "";
+        appesMode = false;
+    }
+
+    inf.init(args[1], _input);
+    ouf.init(args[2], _output);
+    ouf.skipBom();
+    ans.init(args[3], _answer);
+}
+
+void registerTestlib(int argc, ...) {
+    if (argc < 3 || argc > 5)
+        quit(_fail, std::string("Program must be run with the following arguments: ") +
+                    "<input-file> <output-file> <answer-file> [<report-file> [<-appes>]]");
+}
+
+void InStream::init(std::string fileName, TMode mode) {
+    opened = false;
+    name = fileName;
+    stdfile = false;
+    this->mode = mode;
+    skipBom();
+}
+
+#endif
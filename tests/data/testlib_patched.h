@@ -0,0 +1,173 @@
+// Modified by a script to work with DOMjudge.
+// Differences with the standard testlib.h:
+// - The values of some exit codes.
+// - The functions registerInteraction and registerTestlibCmd.
+
+/*
+ * It is strictly recommended to include "testlib.h" before any other include
+ * in your code. In this case testlib overrides compiler specific "random()".
+ *
+ * This file is a reduced snapshot of testlib.h (the parts touched by the
+ * patch for DOMjudge, and some context around them).
+ */
+
+#ifndef _TESTLIB_H_
+#define _TESTLIB_H_
+
+#define VERSION "0.9.41"
+
+#include <cstdio>
+#include <cstdlib>
+#include <string>
+
+#ifndef OK_EXIT_CODE
+#   ifdef CONTESTER
+#       define OK_EXIT_CODE 42
+#   else
+#       define OK_EXIT_CODE 42
+#   endif
+#endif
+
+#ifndef WA_EXIT_CODE
+#   ifdef EJUDGE
+#       define WA_EXIT_CODE 43
+#   elif defined(CONTESTER)
+#       define WA_EXIT_CODE 43
+#   else
+#       define WA_EXIT_CODE 43
+#   endif
+#endif
+
+#ifndef PE_EXIT_CODE
+#   ifdef EJUDGE
+#       define PE_EXIT_CODE 43
+#   elif defined(CONTESTER)
+#       define PE_EXIT_CODE 43
+#   else
+#       define PE_EXIT_CODE 43
+#   endif
+#endif
+
+#ifndef FAIL_EXIT_CODE
+#   ifdef EJUDGE
+#       define FAIL_EXIT_CODE 6
+#   elif defined(CONTESTER)
+#       define FAIL_EXIT_CODE 0xA3
+#   else
+#       define FAIL_EXIT_CODE 3
+#   endif
+#endif
+
+#ifndef DIRT_EXIT_CODE
+#   ifdef EJUDGE
+#       define DIRT_EXIT_CODE 43
+#   else
+#       define DIRT_EXIT_CODE 43
+#   endif
+#endif
+
+#ifndef POINTS_EXIT_CODE
+#   define POINTS_EXIT_CODE 7
+#endif
+
+#ifndef UNEXPECTED_EOF_EXIT_CODE
+#   define UNEXPECTED_EOF_EXIT_CODE 43
+#endif
+
+void InStream::skipBom() {
+    const std::string utf8Bom = "\xEF\xBB\xBF";
+    size_t index = 0;
+    while (index < utf8Bom.size() && curChar() == utf8Bom[index]) {
+        index++;
+        skipChar();
+    }
+}
+
+void registerInteraction(int argc, char *argv[]) {
+    __testlib_ensuresPreconditions();
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _interactor;
+    __testlib_set_binary(stdin);
+
+    if (argc > 1 && !strcmp("--help", argv[1]))
+        __testlib_help();
+    if (argc == 3) {
+        resultName = "";
+        appesMode = false;
+    }
+
+    if (argc == 4) {
+        resultName = std::string(argv[3]) + "/judgemessage.txt";
+        tout.open(std::string(argv[3]) + "/teammessage.txt",
+                  std::ios_base::out);
+        if (tout.fail() || !tout.is_open())
+            quit(_fail, "Can not write to the test-output-file '" +
+                        std::string(argv[2]) + "'");
+        appesMode = false;
+    }
+
+    inf.init(argv[1], _input);
+
+    ouf.init(stdin, _output);
+    if (argc >= 3)
+        ans.init(argv[2], _answer);
+    else
+        ans.name = "unopened answer stream";
+}
+
+void registerValidation() {
+    __testlib_ensuresPreconditions();
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _validator;
+
+    __testlib_set_binary(stdin);
+    __testlib_set_binary(stdout);
+    __testlib_set_binary(stderr);
+
+    inf.init(stdin, _input);
+    inf.strict = true;
+}
+
+void registerTestlibCmd(int argc, char *argv[]) {
+    __testlib_ensuresPreconditions();
+    TestlibFinalizeGuard::registered = true;
+
+    testlibMode = _checker;
+    __testlib_set_binary(stdin);
+
+    if (argc > 1 && !strcmp("--help", argv[1]))
+        __testlib_help();
+
+    appesMode = false;
+
+    if (argc == 3) {
+        resultName = "";
+        appesMode = false;
+    }
+
+    if (argc == 4) {
+        resultName = std::string(argv[3]) + "/judgemessage.txt";
+        appesMode = false;
+    }
+
+    inf.init(argv[1], _input);
+    ouf.init(stdin, _output);
+    ans.init(argv[2], _answer);
+}
+
+void registerTestlib(int argc, ...) {
+    if (argc < 3 || argc > 5)
+        quit(_fail, std::string("Program must be run with the following arguments: ") +
+                    "<input-file> <output-file> <answer-file> [<report-file> [<-appes>]]");
+}
+
+void InStream::init(std::string fileName, TMode mode) {
+    opened = false;
+    name = fileName;
+    stdfile = false;
+    this->mode = mode;
+}
+
+#endif
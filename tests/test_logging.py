@@ -0,0 +1,59 @@
+import concurrent.futures
+import logging
+import sys
+
+import pytest
+
+from p2d import p2d_utils
+
+# Console handler writing to the current sys.stderr (which is replaced by
+# capsys in each test).
+class StderrHandler(p2d_utils.Pol2DomLoggingHandler):
+    @property
+    def stream(self):
+        return sys.stderr
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+@pytest.fixture
+def console(capsys):
+    logger = logging.getLogger('p2d-test')
+    logger.propagate = False
+    handler = StderrHandler()
+    handler.setFormatter(logging.Formatter('{message}', style='{'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield logger
+    logger.removeHandler(handler)
+
+def log_in_pool(logger, message, log_context):
+    def task():
+        with p2d_utils.LogContext(log_context):
+            logger.error(message)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(task).result()
+
+# The logs emitted by a thread pool on behalf of a problem processed
+# concurrently are printed with the other logs of the problem.
+def test_log_context_of_buffered_group(console, capsys):
+    with p2d_utils.ProblemLogGroup('A', buffered=True):
+        console.error('first A')
+        log_in_pool(console, 'pool A', p2d_utils.current_log_context())
+        console.error('last A')
+        assert capsys.readouterr().err == ''
+    with p2d_utils.ProblemLogGroup('B', buffered=True):
+        console.error('first B')
+    captured = capsys.readouterr()
+    assert captured.err == 'first A\npool A\nlast A\nfirst B\n'
+    assert captured.out.index('A') < captured.out.index('B')
+
+def test_log_context_is_restored(console, capsys):
+    with p2d_utils.ProblemLogGroup('A', buffered=True):
+        log_context = p2d_utils.current_log_context()
+    with p2d_utils.LogContext(log_context):
+        assert p2d_utils.current_log_context() == log_context
+    assert p2d_utils.current_log_context() == (0, None)
+    console.error('outside')
+    assert capsys.readouterr().err == 'outside\n'
@@ -0,0 +1,78 @@
+import os
+import zipfile
+
+import pytest
+
+from p2d import file_utils, package_writer
+
+CONTENT = os.urandom(3 * 2**20 + 123) + b'a' * 2**20
+
+@pytest.fixture
+def polygon_zip(tmp_path):
+    path = str(tmp_path / 'polygon.zip')
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('tests/01', CONTENT, compress_type=zipfile.ZIP_DEFLATED)
+        zf.writestr('tests/02', b'1 2\n', compress_type=zipfile.ZIP_STORED)
+    with zipfile.ZipFile(path) as zf:
+        yield zf
+
+def make_entries(tmp_path, polygon_zip):
+    source = tmp_path / 'source.cpp'
+    source.write_bytes(b'int main() {}\n')
+    return [('domjudge-problem.ini', b'name = A\n'),
+            ('data/secret/1.in', file_utils.ZipMember(
+                polygon_zip, polygon_zip.getinfo('tests/01'))),
+            ('data/secret/2.in', file_utils.ZipMember(
+                polygon_zip, polygon_zip.getinfo('tests/02'))),
+            ('submissions/accepted/source.cpp', str(source)),
+            ('problem.yaml', CONTENT),
+            ('data/sample/è.in', b'')]
+
+def check_zip(zip_path, entries, compress_type):
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [arcname for arcname, _ in entries]
+        for arcname, source in entries:
+            if isinstance(source, file_utils.ZipMember):
+                content = source.zip_file.read(source.info)
+            elif isinstance(source, str):
+                with open(source, 'rb') as f:
+                    content = f.read()
+            else:
+                content = source
+            assert zf.read(arcname) == content
+        assert zf.getinfo('domjudge-problem.ini').compress_type == compress_type
+        assert zf.getinfo('submissions/accepted/source.cpp').external_attr >> 16 \
+            == os.stat(entries[3][1]).st_mode
+
+@pytest.mark.parametrize('compression', ['deflated', 'stored'])
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_write_zip(tmp_path, polygon_zip, monkeypatch, compression, jobs):
+    monkeypatch.setattr(package_writer, 'COMPRESSION', compression)
+    monkeypatch.setattr(package_writer, 'ZIP_JOBS', jobs)
+    entries = make_entries(tmp_path, polygon_zip)
+    zip_path = str(tmp_path / 'domjudge.zip')
+    package_writer.write_zip(entries, zip_path)
+    check_zip(zip_path, entries, package_writer.COMPRESSIONS[compression])
+
+# The members compressed as the DOMjudge zip are copied without decompressing
+# them.
+def test_raw_copy(tmp_path, polygon_zip, monkeypatch):
+    copied = []
+    copy_zip_member_raw = package_writer._copy_zip_member_raw
+    def copy(writer, arcname, member):
+        copied.append(arcname)
+        copy_zip_member_raw(writer, arcname, member)
+    monkeypatch.setattr(package_writer, '_copy_zip_member_raw', copy)
+    entries = make_entries(tmp_path, polygon_zip)
+    package_writer.write_zip(entries, str(tmp_path / 'domjudge.zip'))
+    assert copied == ['data/secret/1.in']
+
+def test_zip64(tmp_path, polygon_zip, monkeypatch):
+    monkeypatch.setattr(package_writer, 'ZIP64_LIMIT', 2**20)
+    monkeypatch.setattr(package_writer, 'ZIP_MAX_FILES', 3)
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 2**20)
+    entries = make_entries(tmp_path, polygon_zip)
+    zip_path = str(tmp_path / 'domjudge.zip')
+    package_writer.write_zip(entries, zip_path)
+    check_zip(zip_path, entries, zipfile.ZIP_DEFLATED)
@@ -0,0 +1,171 @@
+import http.server
+import json
+import os
+import re
+import socket
+import threading
+
+import pytest
+
+from p2d import polygon_api
+
+PACKAGE = os.urandom(300 * 1024)
+
+# Stand-in of the Polygon API problem.package. The first `errors` requests
+# fail with status 503. The first `drops` responses are interrupted (the
+# connection is closed) after drop_after bytes. If honour_range is False, the
+# Range header is ignored (the whole package is sent with status 200).
+class PolygonServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, errors=0, drops=0, drop_after=100 * 1024,
+                 honour_range=True):
+        super().__init__(('127.0.0.1', 0), PolygonHandler)
+        self.errors = errors
+        self.drops = drops
+        self.drop_after = drop_after
+        self.honour_range = honour_range
+        self.ranges = []    # The Range header of each request (or None).
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def address(self):
+        return 'http://%s:%s/api/' % self.server_address
+
+class PolygonHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        self.server.ranges.append(self.headers.get('range'))
+        if self.server.errors > 0:
+            self.server.errors -= 1
+            self.send_response(503)
+            self.send_header('content-length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.fullmatch(r'bytes=(\d+)-', self.headers.get('range') or '')
+        if match and self.server.honour_range:
+            start = int(match.group(1))
+            self.send_response(206)
+            self.send_header('content-range', 'bytes %d-%d/%d'
+                             % (start, len(PACKAGE) - 1, len(PACKAGE)))
+        else:
+            self.send_response(200)
+        body = PACKAGE[start:]
+        self.send_header('content-length', str(len(body)))
+        self.end_headers()
+
+        if self.server.drops > 0:
+            self.server.drops -= 1
+            self.wfile.write(body[:self.server.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.wfile.write(body)
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(polygon_api.time, 'sleep', lambda seconds: None)
+
+def download(server, polygon_zip, package_id=7, revision=3):
+    client = polygon_api.PolygonClient('key', 'secret', address=server.address,
+                                       retries=2)
+    client.download_package('problem', package_id, str(polygon_zip),
+                            revision=revision)
+
+def check_downloaded(polygon_zip):
+    assert polygon_zip.read_bytes() == PACKAGE
+    assert not os.path.exists(str(polygon_zip) + '.part')
+    assert not os.path.exists(str(polygon_zip) + '.part.json')
+
+# Returns the offset of the Range header range_header ('bytes=OFFSET-').
+def range_offset(range_header):
+    return int(re.fullmatch(r'bytes=(\d+)-', range_header).group(1))
+
+def test_download_without_errors(tmp_path):
+    server = PolygonServer()
+    download(server, tmp_path / 'a.zip')
+    check_downloaded(tmp_path / 'a.zip')
+    assert server.ranges == [None]
+
+def test_resume_with_range_request(tmp_path):
+    server = PolygonServer(drops=1)
+    download(server, tmp_path / 'a.zip')
+    check_downloaded(tmp_path / 'a.zip')
+    # The download is resumed from the last byte written to disk (the bytes
+    # of the last incomplete chunk are lost).
+    assert len(server.ranges) == 2 and server.ranges[0] is None
+    assert 0 < range_offset(server.ranges[1]) <= server.drop_after
+
+def test_full_download_if_range_is_ignored(tmp_path):
+    server = PolygonServer(drops=1, honour_range=False)
+    download(server, tmp_path / 'a.zip')
+    check_downloaded(tmp_path / 'a.zip')
+    # The range request is sent, but the server answers with the whole
+    # package, which replaces the partial one.
+    assert len(server.ranges) == 2 and server.ranges[0] is None
+    assert 0 < range_offset(server.ranges[1]) <= server.drop_after
+
+def test_resume_from_previous_execution(tmp_path):
+    polygon_zip = tmp_path / 'a.zip'
+    (tmp_path / 'a.zip.part').write_bytes(PACKAGE[:1000])
+    (tmp_path / 'a.zip.part.json').write_text(json.dumps({
+        'problem_id': 'problem', 'package_id': 7, 'revision': 3,
+        'bytes': 1000}))
+    server = PolygonServer()
+    download(server, polygon_zip)
+    check_downloaded(polygon_zip)
+    assert server.ranges == ['bytes=1000-']
+
+@pytest.mark.parametrize('stale_key, stale_value',
+                         [('package_id', 6), ('revision', 2)])
+def test_stale_partial_download_is_discarded(tmp_path, stale_key, stale_value):
+    polygon_zip = tmp_path / 'a.zip'
+    meta = {'problem_id': 'problem', 'package_id': 7, 'revision': 3,
+            'bytes': 1000}
+    meta[stale_key] = stale_value
+    (tmp_path / 'a.zip.part').write_bytes(b'x' * 1000)
+    (tmp_path / 'a.zip.part.json').write_text(json.dumps(meta))
+    server = PolygonServer()
+    download(server, polygon_zip)
+    check_downloaded(polygon_zip)
+    assert server.ranges == [None]
+
+def test_failure_after_all_retries(tmp_path):
+    server = PolygonServer(drops=3)
+    with pytest.raises(polygon_api.RETRIABLE_ERRORS):
+        download(server, tmp_path / 'a.zip')
+    assert not (tmp_path / 'a.zip').exists()
+    # The partial download is kept, so that it can be resumed later.
+    with open(str(tmp_path / 'a.zip.part.json')) as f:
+        received = json.load(f)['bytes']
+    assert 0 < received <= 3 * server.drop_after
+    assert (tmp_path / 'a.zip.part').read_bytes() == PACKAGE[:received]
+
+def test_retry_on_server_error(tmp_path):
+    server = PolygonServer(errors=2)
+    download(server, tmp_path / 'a.zip')
+    check_downloaded(tmp_path / 'a.zip')
+    assert server.ranges == [None, None, None]
+
+# The requests are retried only by PolygonClient (and not also by the
+# session), hence a failing request is sent retries + 1 times.
+def test_single_retry_layer(tmp_path):
+    server = PolygonServer(errors=10)
+    with pytest.raises(polygon_api.RETRIABLE_ERRORS):
+        download(server, tmp_path / 'a.zip')
+    assert len(server.ranges) == 3
+
+    server = PolygonServer(errors=10)
+    client = polygon_api.PolygonClient('key', 'secret', address=server.address,
+                                       retries=2)
+    with pytest.raises(polygon_api.RETRIABLE_ERRORS):
+        client.call('problem.packages', {'problemId': 'problem'})
+    assert len(server.ranges) == 3
@@ -0,0 +1,40 @@
+import zipfile
+
+from p2d import file_utils, parse_polygon_package
+
+def make_package(tmp_path):
+    package_zip = tmp_path / 'problem.zip'
+    with zipfile.ZipFile(str(package_zip), 'w') as zf:
+        zf.writestr('problem.xml', '<problem/>')
+        zf.writestr('tests/01', '1 2\n')
+    directory = tmp_path / 'problem'
+    directory.mkdir()
+    (directory / 'problem.xml').write_text('<problem/>')
+    return str(directory), str(package_zip)
+
+# With an extracted package, the tests are taken from the zip (so that they
+# can be copied raw into the DOMjudge zip) and the other files from the
+# directory.
+def test_tests_are_read_from_the_zip(tmp_path):
+    directory, package_zip = make_package(tmp_path)
+    with parse_polygon_package.PolygonPackage(directory, package_zip) as package:
+        test = package.test_source('tests/01')
+        assert isinstance(test, file_utils.ZipMember)
+        assert test.info.filename == 'tests/01'
+        assert package.source('problem.xml') == str(tmp_path / 'problem' / 'problem.xml')
+        assert not package.exists('tests/01')
+
+def test_tests_without_zip(tmp_path):
+    directory, _ = make_package(tmp_path)
+    (tmp_path / 'problem' / 'tests').mkdir()
+    (tmp_path / 'problem' / 'tests' / '01').write_text('1 2\n')
+    with parse_polygon_package.PolygonPackage(directory) as package:
+        assert package.test_source('tests/01') == str(tmp_path / 'problem' / 'tests' / '01')
+
+def test_zip_only(tmp_path):
+    _, package_zip = make_package(tmp_path)
+    with parse_polygon_package.PolygonPackage(package_zip) as package:
+        assert package.exists('tests/01')
+        assert isinstance(package.source('problem.xml'), file_utils.ZipMember)
+        assert isinstance(package.test_source('tests/01'), file_utils.ZipMember)
+        assert package.read('tests/01') == b'1 2\n'
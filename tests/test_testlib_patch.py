@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from p2d import generate_testlib_for_domjudge, testlib_store
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def read_data(name):
+    with open(os.path.join(DATA_PATH, name), encoding='utf-8') as f:
+        return f.read()
+
+# testlib_patched.h is the output of the line-based patcher used before
+# patch_testlib was rewritten as a single pass; the output must not change
+# (otherwise, PATCH_VERSION must be increased and the file regenerated).
+def test_golden_file():
+    patched = generate_testlib_for_domjudge.patch_testlib(read_data('testlib.h'))
+    assert patched == read_data('testlib_patched.h')
+
+def test_patched_file_is_recognized():
+    assert testlib_store.is_patched(read_data('testlib_patched.h'))
+    assert not testlib_store.is_patched(read_data('testlib.h'))
+
+def test_exit_codes_override():
+    exit_codes = dict(generate_testlib_for_domjudge.NEW_EXIT_CODES)
+    exit_codes['OK_EXIT_CODE'] = 0
+    exit_codes['FAIL_EXIT_CODE'] = 99
+    patched = generate_testlib_for_domjudge.patch_testlib(
+        read_data('testlib.h'), exit_codes=exit_codes).splitlines()
+
+    assert '#       define OK_EXIT_CODE 0' in patched
+    assert '#       define OK_EXIT_CODE 0xAC' not in patched
+    assert '#       define FAIL_EXIT_CODE 99' in patched
+    assert '#       define WA_EXIT_CODE 43' in patched
+    # Only the exit codes in exit_codes are replaced.
+    assert '#   define POINTS_EXIT_CODE 7' in patched
+
+    # The rest of the patch does not depend on the exit codes.
+    default = generate_testlib_for_domjudge.patch_testlib(
+        read_data('testlib.h')).splitlines()
+    assert len(patched) == len(default)
+    assert [line for line in patched if 'EXIT_CODE' not in line] \
+        == [line for line in default if 'EXIT_CODE' not in line]
+
+def test_missing_function():
+    testlib = read_data('testlib.h').replace(
+        'void registerInteraction(int argc, char *argv[]) {',
+        'void registerInteractor(int argc, char *argv[]) {')
+    with pytest.raises(AssertionError):
+        generate_testlib_for_domjudge.patch_testlib(testlib)
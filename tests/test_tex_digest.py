@@ -0,0 +1,27 @@
+import pytest
+
+from p2d import tex_utilities
+
+@pytest.mark.parametrize('reference, path', [
+    ('\\includegraphics{pic}', 'pic.png'),
+    ('\\includegraphics[width=3cm]{images/pic}', 'images/pic.pdf'),
+    ('\\includegraphics{pic.jpg}', 'pic.jpg'),
+    ('\\input{section}', 'section.tex'),
+    ('\\sample{samples/01}', 'samples/01.in'),
+])
+def test_referenced_file_changes_digest(tmp_path, reference, path):
+    tex_file = tmp_path / 'statement.tex'
+    tex_file.write_text(reference + '\n')
+    (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+    (tmp_path / path).write_text('old')
+    old_digest = tex_utilities.tex_digest(str(tex_file))
+    (tmp_path / path).write_text('new')
+    assert tex_utilities.tex_digest(str(tex_file)) != old_digest
+
+def test_unreferenced_file_does_not_change_digest(tmp_path):
+    tex_file = tmp_path / 'statement.tex'
+    tex_file.write_text('\\includegraphics{pic}\n')
+    (tmp_path / 'other.png').write_text('old')
+    old_digest = tex_utilities.tex_digest(str(tex_file))
+    (tmp_path / 'other.png').write_text('new')
+    assert tex_utilities.tex_digest(str(tex_file)) == old_digest
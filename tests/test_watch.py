@@ -0,0 +1,83 @@
+import argparse
+
+import pytest
+
+from p2d import p2d
+
+def make_args(convert=True, domjudge=True):
+    return argparse.Namespace(polygon=True, convert=convert, domjudge=domjudge)
+
+def make_problem(polygon_version, local_version, server_version):
+    return {'name': 'problem', 'polygon_id': 'problem',
+            'polygon_version': polygon_version,
+            'domjudge_local_version': local_version,
+            'domjudge_server_version': server_version}
+
+@pytest.mark.parametrize('problem, latest_revision, expected', [
+    # Up to date.
+    (make_problem(3, 3, 3), 3, False),
+    # New package on Polygon.
+    (make_problem(3, 3, 3), 4, True),
+    (make_problem(-1, -1, -1), 1, True),
+    # The conversion of the downloaded package failed.
+    (make_problem(4, 3, 3), 4, True),
+    # The upload of the converted package failed.
+    (make_problem(4, 4, 3), 4, True),
+])
+def test_needs_processing(problem, latest_revision, expected):
+    assert p2d.needs_processing(make_args(), problem,
+                                (latest_revision, 7)) == expected
+
+def test_failed_conversion_is_retried_only_with_convert():
+    problem = make_problem(4, 3, 3)
+    assert not p2d.needs_processing(make_args(convert=False, domjudge=False),
+                                    problem, (4, 7))
+    assert p2d.needs_processing(make_args(convert=True, domjudge=False),
+                                problem, (4, 7))
+
+def test_failed_upload_is_retried_only_with_domjudge():
+    problem = make_problem(4, 4, 3)
+    assert not p2d.needs_processing(make_args(domjudge=False), problem, (4, 7))
+    assert p2d.needs_processing(make_args(domjudge=True), problem, (4, 7))
+
+class FakeStore:
+    def __init__(self, problems):
+        self.config = {'contest_name': 'Contest', 'problems': problems}
+        self.flushed = False
+
+    def reload(self):
+        pass
+
+    def flush(self):
+        self.flushed = True
+
+def test_watch_round_logs_the_errors_of_the_problems(monkeypatch):
+    problem = make_problem(3, 3, 3)
+    store = FakeStore([problem])
+    monkeypatch.setattr(p2d, 'poll_latest_packages',
+                        lambda polygon, problems, jobs: {'problem': (4, 7)})
+    def run_pipeline(*args):
+        exit(1)
+    monkeypatch.setattr(p2d, 'run_pipeline', run_pipeline)
+    args = make_args()
+    args.problems = None
+    args.jobs = 1
+    args.pdf = False
+    p2d.watch_round(args, store, 'contest', None, None, None, 'testlib.h')
+    assert store.flushed
+
+def test_watch_backoff_only_on_polling_errors(monkeypatch):
+    errors = [p2d.requests.exceptions.ConnectionError('Polygon is down'),
+              SystemExit(1), None, KeyboardInterrupt()]
+    def watch_round(*args):
+        error = errors.pop(0)
+        if error is not None:
+            raise error
+    delays = []
+    monkeypatch.setattr(p2d, 'watch_round', watch_round)
+    monkeypatch.setattr(p2d.time, 'sleep', delays.append)
+    monkeypatch.setattr(p2d.random, 'uniform', lambda a, b: 1)
+    args = make_args()
+    args.watch = 10
+    p2d.watch(args, None, 'contest', None, None, None, 'testlib.h')
+    assert delays == [10, 20, 20, 10]